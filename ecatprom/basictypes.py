@@ -1,10 +1,16 @@
 import struct
+from array import array
+from types import MappingProxyType
 
 
 class OutOfBytesError(Exception):
     pass
 
 
+class LayoutError(TypeError):
+    '''A layout that cant be handled by a Codec, say because it has no fixed size'''
+
+
 class Reader:
 
     def __init__(self, readable, bits_per_byte=8):
@@ -13,15 +19,27 @@ class Reader:
         self.bytes_buffer = 0
         self.bpb = bits_per_byte
 
-    def read_bytes(self, n):
-        '''Read n bytes'''
-        if self.pos_bits != 0:
-            raise ValueError('Cant read bytes until byte aligned')
+    def _take(self, n):
+        '''Pull exactly n raw bytes from the underlying data'''
         d = self._data.read(n)
         if len(d) != n:
             raise OutOfBytesError()
         return d
 
+    def read_bytes(self, n):
+        '''Read n bytes'''
+        if self.pos_bits != 0:
+            raise ValueError('Cant read bytes until byte aligned')
+        return self._take(n)
+
+    def read_view(self, n):
+        '''Read n bytes, possibly as a view into the underlying data'''
+        return self.read_bytes(n)
+
+    def sub_reader(self, n):
+        '''Read n bytes and return a reader limited to them'''
+        return BufferReader(self.read_view(n), self.bpb)
+
     def read_bits(self, n):
         '''Read n bits, little endian, least significant bit first each byte
 
@@ -29,14 +47,27 @@ class Reader:
         '''
         if n > 64 or n < 1:
             raise ValueError('Cowardly refusing to read that many bits')
+        if self.bpb != 8:
+            return self._read_bits_slow(n)
+        have = self.pos_bits
+        if n > have:
+            # pull every byte we still need in one go and splice it on top of
+            # whatever is left of the last partially consumed byte
+            need = (n - have + 7) // 8
+            self.bytes_buffer |= int.from_bytes(self._take(need), 'little') << have
+            have += need * 8
+        val = self.bytes_buffer & ((1 << n) - 1)
+        self.bytes_buffer >>= n
+        self.pos_bits = have - n
+        return val
+
+    def _read_bits_slow(self, n):
+        '''Bit by bit version of read_bits for odd byte sizes'''
         pos = n-1
         val = 0
         while n > 0:
             if self.pos_bits <= 0:
-                d = self._data.read(1)
-                if len(d) != 1:
-                    raise OutOfBytesError()
-                self.bytes_buffer = struct.unpack('b', d)[0]
+                self.bytes_buffer = struct.unpack('b', self._take(1))[0]
                 self.pos_bits = self.bpb
             self.pos_bits -= 1
             val = val >> 1
@@ -46,31 +77,83 @@ class Reader:
         return val
 
 
+class BufferReader(Reader):
+    '''Reader over anything supporting the buffer protocol (bytes, mmap, ...)
+
+    Views and sub readers share the memory of the original buffer, nothing is
+    copied until read_bytes is called
+    '''
+
+    def __init__(self, buffer, bits_per_byte=8):
+        Reader.__init__(self, None, bits_per_byte)
+        self._view = memoryview(buffer)
+        self.pos = 0
+
+    def _take(self, n):
+        start = self.pos
+        self.pos = min(start + n, len(self._view))
+        if self.pos - start != n:
+            raise OutOfBytesError()
+        return self._view[start:self.pos]
+
+    def read_bytes(self, n):
+        '''Read n bytes'''
+        return bytes(self.read_view(n))
+
+    def read_view(self, n):
+        '''Read n bytes as a view into the buffer'''
+        if self.pos_bits != 0:
+            raise ValueError('Cant read bytes until byte aligned')
+        return self._take(n)
+
+    def remaining(self):
+        '''Number of bytes not read yet'''
+        return len(self._view) - self.pos
+
+
 class Writer:
 
-    def __init__(self, writeable, bits_per_byte=8):
+    def __init__(self, writeable, bits_per_byte=8, chunk_size=0):
+        '''
+        writeable - where the bytes end up
+        chunk_size - finished bytes are held back until there are more than
+                     this many (or flush is called), 0 passes them on as soon
+                     as each write completes
+        '''
         self._data = writeable
-        self.pos_bits = 0
-        self.bytes_buffer = 0
         self.bpb = bits_per_byte
+        self.chunk_size = chunk_size
+        self._out = bytearray()  # finished bytes not handed to writeable yet
+        self._acc = 0  # bits of an unfinished byte
+        self._nbits = 0
+
+    @property
+    def pos_bits(self):
+        '''Bits written into the current unfinished byte'''
+        return self._nbits
 
     def flush(self):
-        self.write_bytes(b'')
+        if self._nbits != 0:
+            raise ValueError('Cant write bytes until byte aligned')
+        self._emit()
+
+    def _emit(self):
+        if self._out:
+            nn = self._data.write(self._out)
+            if nn != len(self._out):
+                raise OutOfBytesError()
+            self._out = bytearray()
+
+    def _drain(self):
+        if len(self._out) > self.chunk_size:
+            self._emit()
 
     def write_bytes(self, d):
         '''Write bytes'''
-        if self.pos_bits == self.bpb:
-            nn = self._data.write(self.bytes_buffer.to_bytes(1, 'little'))
-            if nn != 1:
-                raise OutOfBytesError()
-            self.pos_bits = 0
-            self.bytes_buffer = 0
-        elif self.pos_bits != 0:
+        if self._nbits != 0:
             raise ValueError('Cant write bytes until byte aligned')
-        nn = self._data.write(d)
-        if len(d) != nn:
-            raise OutOfBytesError()
-        return
+        self._out += d
+        self._drain()
 
     def write_bits(self, val, n):
         '''Write n bits, little endian, least significant bit first each byte
@@ -80,29 +163,36 @@ class Writer:
         if n > 64 or n < 1:
             raise ValueError(
                 'Cowardly refusing to write that many bits ({})'.format(n))
-        # if we can write full bytes lets just do that
-        try:
-            if n % self.bpb == 0:
-                self.write_bytes(val.to_bytes(n//self.bpb, 'little'))
-                return
-        # if we are unaligned we can still write bit by bit
-        except ValueError:
-            pass
-        # otherwise we gotta do stuff bit by bit
-        while n > 0:
-            if self.pos_bits == self.bpb:
-                # write bytes will write and clear the state if a full byte is ready for writing
-                self.write_bytes(b'')
-            self.bytes_buffer |= ((val & 1) << self.pos_bits)
-            self.pos_bits += 1
-            val = val >> 1
-            n -= 1
-        return
+        if self._nbits == 0 and n % self.bpb == 0:
+            # if we can write full bytes lets just do that
+            self._out += val.to_bytes(n//self.bpb, 'little')
+        else:
+            # otherwise stack the bits on top of the unfinished byte and
+            # split off whatever bytes that completes
+            self._acc |= (val & ((1 << n) - 1)) << self._nbits
+            self._nbits += n
+            if self.bpb == 8:
+                nbytes = self._nbits >> 3
+                if nbytes:
+                    self._out += (self._acc & ((1 << 8*nbytes) - 1)).to_bytes(nbytes, 'little')
+                    self._acc >>= 8*nbytes
+                    self._nbits &= 7
+            else:
+                while self._nbits >= self.bpb:
+                    self._out.append(self._acc & ((1 << self.bpb) - 1))
+                    self._acc >>= self.bpb
+                    self._nbits -= self.bpb
+        self._drain()
 
 
 # basically all our types can be serialized and deserialized
 class Item:
 
+    __slots__ = ()
+
+    # set once a value is changed after being created or taken
+    dirty = False
+
     def take(self, reader):
         pass
 
@@ -113,6 +203,10 @@ class Item:
 class NullBytes:
     '''Throw away data'''
 
+    __slots__ = ('n', 'write_ones')
+
+    dirty = False  # nothing to change
+
     def __init__(self, n, write_ones=False):
         self.n = n
         self.write_ones = write_ones
@@ -124,6 +218,9 @@ class NullBytes:
         b = b'\xFF' if self.write_ones else b'\x00'
         writer.write_bytes(b*self.n)
 
+    def copy(self):
+        return self  # holds no values
+
     def __str__(self):
         return 'NullBytes({})'.format(self.n)
 
@@ -131,6 +228,8 @@ class NullBytes:
 class NullBits(NullBytes):
     '''Throw away data'''
 
+    __slots__ = ()
+
     def take(self, reader):
         reader.read_bits(self.n)
 
@@ -146,10 +245,13 @@ class NullBits(NullBytes):
 
 class Int(Item):
 
+    __slots__ = ('bits', '_value', 'bounds', 'dirty')
+
     def __init__(self, bits, bounds=None):
         self.bits = bits
         self._value = 0
         self.bounds = None
+        self.dirty = False
 
     def take(self, reader):
         self._value = reader.read_bits(self.bits)
@@ -168,21 +270,71 @@ class Int(Item):
                 raise ValueError(
                     "Value {} out of bounds {}".format(v, self.bounds))
         self._value = v
+        self.dirty = True
+
+    def copy(self):
+        c = object.__new__(type(self))
+        c.bits = self.bits
+        c._value = self._value
+        c.bounds = self.bounds
+        c.dirty = self.dirty
+        return c
 
     def __str__(self):
         return '{}(0x{:X})'.format(self._value, self._value)
 
 
+_reverse_maps = {}  # id(options) -> (options, {label: code})
+
+
+def reverse_map(options):
+    '''{label: code} for an options table
+
+    Where a label appears more than once the first code wins. Read only tables
+    (MappingProxyType, as the layouts in sii use) get one map shared by
+    everything using them, plain dicts get a map of their own so nothing keeps
+    them alive
+    '''
+    shared = isinstance(options, MappingProxyType)
+    if shared:
+        entry = _reverse_maps.get(id(options))
+        if entry != None and entry[0] is options:
+            return entry[1]
+    codes = {}
+    for k, v in options.items():
+        codes.setdefault(v, k)
+    if shared:
+        # keep options alive with the map so its id cant be reused
+        _reverse_maps[id(options)] = (options, codes)
+    return codes
+
+
 class Enum(Int):
 
+    __slots__ = ('options', '_codes')
+
     def __init__(self, bits, options):
         '''
         bits - number of bits in serialized form
         options - {int: obj} dict where int is the numeric representation and object is anything
+
+        options is kept by reference and treated as read only, factories
+        should share one MappingProxyType table so the reverse map is shared too
         '''
         self.bits = bits
-        self._value = tuple(options.keys())[0]
+        self._value = next(iter(options))
+        self.bounds = None
+        self.dirty = False
         self.options = options
+        self._codes = reverse_map(options)
+
+    def code_for(self, v):
+        '''Numeric representation of an option'''
+        try:
+            return self._codes[v]
+        except (KeyError, TypeError):
+            raise ValueError("Value {} not a valid enumeration {}".format(
+                v, self.options.values()))
 
     @property
     def value(self):
@@ -193,14 +345,15 @@ class Enum(Int):
 
     @value.setter
     def value(self, v):
-        if v not in self.options.values():
-            raise ValueError("Value {} not a valid enumeration {}".format(
-                v, self.options.values()))
-        for k, vv in self.options.items():
-            if vv == v:
-                self._value = k
-                return
-        raise RuntimeError('This should never happen')
+        self._value = self.code_for(v)
+        self.dirty = True
+
+    def copy(self):
+        '''Independent copy, the option table is still shared'''
+        c = Int.copy(self)
+        c.options = self.options
+        c._codes = self._codes
+        return c
 
     def __str__(self):
         n = self.value
@@ -209,11 +362,30 @@ class Enum(Int):
         return n + '(0x{:X})'.format(self._value)
 
 
+def assign(items, value):
+    '''Set the same value on lots of Int/Enum fields
+
+    Enum options are only looked up once per options table
+    '''
+    codes = {}
+    for item in items:
+        if isinstance(item, Enum):
+            key = id(item.options)
+            if key not in codes:
+                codes[key] = item.code_for(value)
+            item._value = codes[key]
+            item.dirty = True
+        else:
+            item.value = value
+
+
 class Struct(Item):
 
+    __slots__ = ('_members',)
+
     def __init__(self, **kwargs):
         self._members = kwargs
-        if 'put' in kwargs.keys() or 'take' in kwargs.keys():
+        if kwargs.keys() & {'put', 'take', 'dirty', 'copy'}:
             raise ValueError('You used a reserved member name')
 
     def take(self, reader):
@@ -224,10 +396,19 @@ class Struct(Item):
         for v in self._members.values():
             v.put(writer)
 
+    @property
+    def dirty(self):
+        return any(v.dirty for v in self._members.values())
+
+    def copy(self):
+        c = object.__new__(type(self))
+        c._members = {k: v.copy() for k, v in self._members.items()}
+        return c
+
     def __getattr__(self, k):
         try:
             return self._members[k]
-        except KeyError:
+        except (KeyError, TypeError):  # arrays hold a list
             raise AttributeError('This struct has no member "{}"'.format(k))
 
     def __str__(self):
@@ -245,9 +426,12 @@ class Struct(Item):
 
 class String(Item):
 
+    __slots__ = ('_value', 'dirty')
+
     def __init__(self, value=''):
         self._value = None
         self.value = value
+        self.dirty = False
 
     def take(self, reader):
         slen = Int(8)
@@ -269,6 +453,13 @@ class String(Item):
         if len(r) > 255:
             raise ValueError('String too long')
         self._value = r
+        self.dirty = True
+
+    def copy(self):
+        c = object.__new__(String)
+        c._value = self._value
+        c.dirty = self.dirty
+        return c
 
     def __str__(self):
         return '{}'.format(self._value)
@@ -276,28 +467,35 @@ class String(Item):
 
 class Array(Struct):
 
+    __slots__ = ('_count', '_type', 'length_prefixed', '_changed')
+
     def __init__(self, item_type, count=None, length_prefixed=False):
         self._members = []
         self._count = count
         self._type = item_type
         self.length_prefixed = length_prefixed
+        self._changed = False
 
     def take(self, reader):
         if self.length_prefixed:
             l = Int(8)
             l.take(reader)
             self._count = l.value
-        if self._count:
-            for _ in range(self._count):
+        codec = codec_for(self._type)
+        if codec:
+            make = codec.take
+        else:
+            def make(reader):
                 d = self._type()
                 d.take(reader)
-                self._members.append(d)
+                return d
+        if self._count:
+            for _ in range(self._count):
+                self._members.append(make(reader))
         else:
             while True:
                 try:
-                    d = self._type()
-                    d.take(reader)
-                    self._members.append(d)
+                    self._members.append(make(reader))
                 except OutOfBytesError:
                     break
 
@@ -306,21 +504,48 @@ class Array(Struct):
             l = Int(8)
             l.value = len(self)
             l.put(writer)
+        codec = codec_for(self._type)
         for v in self._members:
-            v.put(writer)
+            if codec:
+                codec.put(v, writer)
+            else:
+                v.put(writer)
 
     def __getitem__(self, k):
         return self._members[k]
 
     def __setitem__(self, k, v):
         self._members[k] = v
+        self._changed = True
 
     def __len__(self):
         return len(self._members)
 
     def append(self, v):
+        self._changed = True
         return self._members.append(v)
 
+    def column(self, path):
+        '''array of the raw value at a dotted path in every member'''
+        leaves = self._members
+        for k in path.split('.') if path else ():
+            leaves = [l._members[k] for l in leaves]
+        bits = leaves[0].bits if leaves else 64
+        return array(typecode_for(bits), (l._value for l in leaves))
+
+    @property
+    def dirty(self):
+        return self._changed or any(v.dirty for v in self._members)
+
+    def copy(self):
+        c = object.__new__(type(self))
+        c._members = [v.copy() for v in self._members]
+        c._count = self._count
+        c._type = self._type
+        c.length_prefixed = self.length_prefixed
+        c._changed = self._changed
+        return c
+
     def __str__(self):
         s = []
         for vi, v in enumerate(self._members):
@@ -332,3 +557,256 @@ class Array(Struct):
                 for l in lines:
                     s.append('  ' + l)
         return '\n'.join(s)
+
+
+def typecode_for(bits):
+    '''Smallest unsigned array typecode that holds a number of bits'''
+    for tc in 'BHILQ':
+        if array(tc).itemsize * 8 >= bits:
+            return tc
+    raise ValueError('No array type for {} bits'.format(bits))
+
+
+def walk(item, path=()):
+    '''Yield (path, leaf) for every value in an item, in serialization order
+
+    path is a tuple of member names and array indexes, padding is skipped
+    '''
+    if isinstance(item, Array):
+        members = enumerate(item._members)
+    elif isinstance(item, Struct):
+        members = item._members.items()
+    else:
+        if not isinstance(item, NullBytes):
+            yield path, item
+        return
+    for k, v in members:
+        yield from walk(v, path + (k,))
+
+def _leaves(item):
+    '''Flatten a fixed size item into its leaves in serialization order'''
+    if isinstance(item, Array) or isinstance(item, String):
+        raise LayoutError('{} has no fixed size'.format(type(item).__name__))
+    if isinstance(item, Struct):
+        leaves = []
+        for v in item._members.values():
+            leaves.extend(_leaves(v))
+        return leaves
+    return [item]
+
+
+def _leaf_bits(leaf):
+    if isinstance(leaf, NullBits):
+        return leaf.n
+    if isinstance(leaf, NullBytes):
+        return leaf.n * 8
+    if isinstance(leaf, Int):
+        return leaf.bits
+    raise LayoutError('Dont know how to compile {}'.format(type(leaf).__name__))
+
+
+class _Mismatch(Exception):
+    '''An item is not shaped like the layout of a Codec'''
+
+
+def _builder(proto, fields):
+    '''Function making a copy of proto from unpacked units
+
+    fields - iterator of (unit index, shift, mask) for the value leaves, see Codec
+    '''
+    if isinstance(proto, Struct):
+        cls = type(proto)
+        members = [(k, _builder(v, fields)) for k, v in proto._members.items()]
+
+        def build(vals):
+            item = object.__new__(cls)
+            item._members = {k: b(vals) for k, b in members}
+            return item
+        return build
+    if isinstance(proto, NullBytes):
+        return lambda vals: proto  # holds no values so can be shared
+    idx, shift, mask = next(fields)
+    if mask is None:
+        def build(vals):
+            leaf = proto.copy()
+            leaf._value = vals[idx]
+            return leaf
+    else:
+        def build(vals):
+            leaf = proto.copy()
+            leaf._value = (vals[idx] >> shift) & mask
+            return leaf
+    return build
+
+
+def _flattener(proto, fields):
+    '''Function oring the values of an item shaped like proto into a list of units
+
+    Raises _Mismatch for items of another shape
+    '''
+    if isinstance(proto, Struct):
+        keys = set(proto._members)
+        members = [(k, _flattener(v, fields)) for k, v in proto._members.items()
+                   if not isinstance(v, NullBytes)]
+
+        def flatten(item, vals):
+            if not isinstance(item, Struct) or type(item._members) is not dict or \
+                    item._members.keys() != keys:
+                raise _Mismatch()
+            for k, f in members:
+                f(item._members[k], vals)
+        return flatten
+    idx, shift, mask = next(fields)
+    if mask is None:
+        def flatten(item, vals):
+            if not isinstance(item, Int):
+                raise _Mismatch()
+            vals[idx] = item._value
+    else:
+        def flatten(item, vals):
+            if not isinstance(item, Int):
+                raise _Mismatch()
+            vals[idx] |= (item._value & mask) << shift
+    return flatten
+
+
+class Codec:
+    '''Flat decoder/encoder for a fixed size layout
+
+    The layout is split into byte aligned units which are all handled by one
+    struct.Struct. Bit fields sharing a unit are pulled apart with precomputed
+    shift/mask tables. Use codec_for() to get a cached instance per factory.
+    '''
+
+    _formats = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+    def __init__(self, factory):
+        self.factory = factory
+        proto = factory()
+        leaves = _leaves(proto)
+        fmt = ['<']
+        self._fields = []  # (unit index, shift, mask) for each value leaf
+        self._consts = []  # bits forced on by NullBytes(write_ones=True) per unit
+        self._blobs = []  # units that are too odd sized for a struct integer
+        unit = []
+        bits = 0
+        for leaf in leaves:
+            unit.append((leaf, bits))
+            bits += _leaf_bits(leaf)
+            if bits % 8:
+                continue
+            n = bits // 8
+            if all(isinstance(l, NullBytes) and not l.write_ones for l, _ in unit):
+                fmt.append('{}x'.format(n))
+            else:
+                idx = len(self._consts)
+                if n in self._formats:
+                    fmt.append(self._formats[n])
+                else:
+                    fmt.append('{}s'.format(n))
+                    self._blobs.append((idx, n))
+                const = 0
+                for l, shift in unit:
+                    mask = (1 << _leaf_bits(l)) - 1
+                    if isinstance(l, NullBytes):
+                        if l.write_ones:
+                            const |= mask << shift
+                    else:
+                        # whole unit fields are left unmasked so overflow still errors
+                        self._fields.append((idx, shift, mask if len(unit) > 1 else None))
+                self._consts.append(const)
+            unit = []
+            bits = 0
+        if unit:
+            raise LayoutError('Layout does not end on a byte boundary')
+        self._struct = struct.Struct(''.join(fmt))
+        self.size = self._struct.size
+        # dotted path and width of each value leaf, in the same order as _fields
+        self.paths = ['.'.join(str(p) for p in path) for path, _ in walk(proto)]
+        self._widths = [_leaf_bits(l) for l in leaves if not isinstance(l, NullBytes)]
+        self._offsets = []  # bit offset of each value leaf
+        self.gaps = []  # (byte offset, byte count) of each whole byte NullBytes leaf
+        bits = 0
+        for l in leaves:
+            if not isinstance(l, NullBytes):
+                self._offsets.append(bits)
+            elif not isinstance(l, NullBits) and not bits % 8:
+                self.gaps.append((bits // 8, l.n))
+            bits += _leaf_bits(l)
+        # made once, so take and put dont have to walk the layout per record
+        self._build = _builder(proto, iter(self._fields))
+        self._flatten = _flattener(proto, iter(self._fields))
+
+    def byte_range(self, path):
+        '''(byte offset, byte count) of a whole byte field given by its dotted path'''
+        i = self.paths.index(path)
+        offset, bits = self._offsets[i], self._widths[i]
+        if offset % 8 or bits % 8:
+            raise ValueError('{} is not byte aligned'.format(path))
+        return offset // 8, bits // 8
+
+    def take(self, reader):
+        '''Decode a fresh item from the reader'''
+        if reader.pos_bits != 0 or reader.bpb != 8:
+            item = self.factory()
+            item.take(reader)
+            return item
+        vals = self._struct.unpack(reader.read_view(self.size))
+        if self._blobs:
+            vals = list(vals)
+            for idx, _ in self._blobs:
+                vals[idx] = int.from_bytes(vals[idx], 'little')
+        return self._build(vals)
+
+    def columns(self, data, paths=None):
+        '''{path: array} of field values for back to back records in data
+
+        Works straight on the bytes without building any items, a trailing
+        partial record is ignored
+        '''
+        n = len(data) // self.size
+        rows = list(self._struct.iter_unpack(memoryview(data)[:n * self.size]))
+        cols = {}
+        for path, bits, (idx, shift, mask) in zip(self.paths, self._widths, self._fields):
+            if paths != None and path not in paths:
+                continue
+            if any(idx == i for i, _ in self._blobs):
+                vals = (int.from_bytes(r[idx], 'little') for r in rows)
+            else:
+                vals = (r[idx] for r in rows)
+            if mask != None:
+                vals = ((v >> shift) & mask for v in vals)
+            cols[path] = array(typecode_for(bits), vals)
+        return cols
+
+    def put(self, item, writer):
+        '''Encode an item produced by our factory'''
+        if writer.bpb != 8 or writer.pos_bits not in (0, writer.bpb):
+            item.put(writer)
+            return
+        vals = list(self._consts)
+        try:
+            self._flatten(item, vals)
+        except _Mismatch:
+            item.put(writer)  # not shaped like what our factory makes
+            return
+        for idx, n in self._blobs:
+            vals[idx] = vals[idx].to_bytes(n, 'little')
+        writer.write_bytes(self._struct.pack(*vals))
+
+
+_codecs = {}
+
+
+def codec_for(factory):
+    '''Cached Codec for a factory, None if what it makes is not fixed size'''
+    try:
+        return _codecs[factory]
+    except KeyError:
+        pass
+    try:
+        codec = Codec(factory)
+    except LayoutError:
+        codec = None
+    _codecs[factory] = codec
+    return codec
@@ -0,0 +1,125 @@
+'''Summarize lots of SII images at once, spread over several processes'''
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+import fnmatch
+import os
+
+from . import sii
+from . import parsecache
+from .cache import CategoryCache
+
+# per process, so strings seen in earlier files are copied rather than decoded again
+_cache = CategoryCache()
+
+# only small plain values so results are cheap to send back from the workers
+Summary = namedtuple('Summary', [
+    'path',
+    'vendor_id',
+    'product_code',
+    'revision_number',
+    'serial_number',
+    'configured_alias',
+    'name',
+    'categories',  # category types in the order they appear
+    'error',  # None if the file parsed
+])
+
+
+def summarize_bytes(path, data):
+    '''Summary of an image in memory, only the categories needed are decoded'''
+    s = sii.from_bytes(data, lazy=True, cache=_cache)
+    i = s.info.id
+    return Summary(
+        path=path,
+        vendor_id=i.vendor_id.value,
+        product_code=i.product_code.value,
+        revision_number=i.revision_number.value,
+        serial_number=i.serial_number.value,
+        configured_alias=s.info.configured_alias.value,
+        name=s.general_name,
+        categories=tuple(e.category_type for e in sii.SiiIndex.build(data).entries),
+        error=None,
+    )
+
+
+def summarize(path):
+    '''Summary of a single file, problems are reported in the error field'''
+    try:
+        with open(path, 'rb') as f:
+            return summarize_bytes(path, f.read())
+    except Exception as e:
+        return Summary(path, None, None, None, None, None, None, (),
+                       '{}: {}'.format(type(e).__name__, e))
+
+
+def find_images(paths, pattern='*.bin'):
+    '''Yield files as given, and matching files anywhere under given directories'''
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for f in sorted(fnmatch.filter(files, pattern)):
+                    yield os.path.join(root, f)
+        else:
+            yield p
+
+
+def map_workers(fn, items, workers=None, chunksize=32):
+    '''Yield fn(item) for each item in order, spread over worker processes
+
+    workers - number of processes, defaults to one per core. With 1 everything
+              happens in this process
+    '''
+    if workers == None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for i in items:
+            yield fn(i)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(fn, items, chunksize=chunksize)
+
+
+def parse_many(paths, workers=None, chunksize=32, cache=None):
+    '''Yield a Summary for each path, in order
+
+    workers - number of processes, defaults to one per core. With 1 everything
+              happens in this process
+    chunksize - paths handed to a worker at a time
+    cache - a parsecache.ParseCache, only files it has no current entry for
+            get parsed (and are then added to it)
+    '''
+    if cache == None:
+        yield from map_workers(summarize, paths, workers, chunksize)
+        return
+    paths = list(paths)
+    found = [cache.summary(p) for p in paths]
+    misses = [p for p, r in zip(paths, found) if r == None]
+    fresh = {}
+    for p, scanned in zip(misses, map_workers(_scan_or_fail, misses, workers, chunksize)):
+        if isinstance(scanned, Summary):
+            fresh[p] = scanned
+        else:
+            cache.store(scanned)
+            fresh[p] = scanned.summary
+    for p, r in zip(paths, found):
+        yield r if r != None else fresh[p]
+
+
+def _scan_or_fail(path):
+    '''parsecache.scan, or an error Summary for files that cant be read'''
+    try:
+        return parsecache.scan(path)
+    except Exception as e:
+        return Summary(path, None, None, None, None, None, None, (),
+                       '{}: {}'.format(type(e).__name__, e))
+
+
+def format_summary(r):
+    '''One line, tab separated, description of a Summary'''
+    if r.error:
+        return '{}\tERROR\t{}'.format(r.path, r.error)
+    return '{}\t0x{:08X}\t0x{:08X}\t0x{:08X}\t{}\t{}\t{}\t{}'.format(
+        r.path, r.vendor_id, r.product_code, r.revision_number, r.serial_number,
+        r.configured_alias, r.name or '',
+        ','.join('0x{:X}'.format(c) for c in r.categories))
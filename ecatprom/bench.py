@@ -0,0 +1,220 @@
+'''Benchmarks for the parse/serialize hot paths over synthetic images
+
+    python -m ecatprom.bench --out results.json
+
+Results are a JSON list with one entry per (benchmark, size) giving
+throughput and the peak memory traced during a single run, so numbers can be
+compared between releases.
+'''
+from io import BytesIO
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from . import sii
+from .template import Template
+from .basictypes import *
+from .sii import CatType
+
+# name -> synthetic_image arguments
+SIZES = {
+    'small': dict(strings=4, syncm=4, fmmu=2, pdos=2, pdo_entries=2, unknown=0),
+    'medium': dict(strings=32, syncm=8, fmmu=4, pdos=16, pdo_entries=8, unknown=4),
+    'large': dict(strings=200, syncm=16, fmmu=16, pdos=64, pdo_entries=16, unknown=16),
+}
+
+
+def _pdo_category(rng, index, entries):
+    '''Raw payload of a PDO category: 8 byte PDO header then 8 bytes per entry'''
+    data = bytearray()
+    data += index.to_bytes(2, 'little')
+    data += bytes([entries, rng.randrange(2, 4), 0, rng.randrange(256)])
+    data += b'\x00\x00'  # flags
+    for e in range(entries):
+        data += (0x6000 + e).to_bytes(2, 'little')
+        data += bytes([e + 1, rng.randrange(256), 0x07, rng.choice((1, 8, 16, 32))])
+        data += b'\x00\x00'
+    return bytes(data)
+
+
+def synthetic_image(strings=4, syncm=4, fmmu=2, pdos=0, pdo_entries=4, unknown=0, seed=0):
+    '''Bytes of a plausible SII image of a given shape
+
+    pdos - number of TXPDO and of RXPDO categories, each with pdo_entries entries
+    unknown - number of vendor specific categories with random contents
+    '''
+    rng = random.Random(seed)
+    s = sii.Sii()
+    s.info = sii.InfoStructure()
+    s.info.id.vendor_id.value = 0x2
+    s.info.id.product_code.value = rng.randrange(1 << 32)
+    s.info.id.serial_number.value = rng.randrange(1 << 32)
+    s.info.size.value = 0x7F
+    s.info.version.value = 1
+    s.general = sii.CategoryGeneral()
+    s.strings = Array(String, length_prefixed=True)
+    for i in range(strings):
+        s.strings.append(String('String {} {}'.format(i, 'x' * rng.randrange(24))))
+    if strings:
+        s.general.name_idx.value = 1
+        s.general.group_idx.value = min(2, strings)
+    s.fmmu = Array(item_type=sii.Fmmu)
+    for i in range(fmmu):
+        f = sii.Fmmu()
+        f.value = ('OUTPUTS', 'INPUTS', 'SYNCM STATUS')[i % 3]
+        s.fmmu.append(f)
+    s.syncm = Array(item_type=sii.SyncM)
+    for i in range(syncm):
+        m = sii.SyncM()
+        m.physical_start_addr.value = 0x1000 + 0x80 * i
+        m.length.value = 0x80
+        m.enable_sync_mananger.enable.value = 1
+        m.sync_manager_type.value = ('MBX_OUT', 'MBX_IN', 'PROCESS_DATA_OUT', 'PROCESS_DATA_IN')[i % 4]
+        s.syncm.append(m)
+    # one category per PDO, written out raw so the PDO code is not needed here
+    for i in range(pdos):
+        s.unknown.append((CatType.TXPDO, _pdo_category(rng, 0x1A00 + i, pdo_entries)))
+    for i in range(pdos):
+        s.unknown.append((CatType.RXPDO, _pdo_category(rng, 0x1600 + i, pdo_entries)))
+    for i in range(unknown):
+        n = 2 * rng.randrange(1, 64)
+        s.unknown.append((0x0800 + i, bytes(rng.randrange(256) for _ in range(n))))
+    return sii.to_bytes(s, fix_checksum=True)
+
+
+def _bits_workload(rng, nbytes):
+    '''Field widths adding up to nbytes, mixing bit fields and aligned words'''
+    widths = []
+    total = 0
+    while total < nbytes * 8 - 64:
+        n = rng.choice((1, 1, 2, 4, 8, 16, 16, 32))
+        widths.append(n)
+        total += n
+    widths.append(8 - total % 8 if total % 8 else 8)
+    return widths
+
+
+def benchmarks(data):
+    '''name -> (function of no arguments, bytes processed per call)'''
+    rng = random.Random(1)
+    widths = _bits_workload(rng, len(data))
+    values = [rng.randrange(1 << n) for n in widths]
+    parsed = sii.from_bytes(data)
+    fresh = sii.from_bytes(data)
+    fresh._orig.clear()  # nothing to copy out, put has to encode everything
+
+    def read_bits():
+        r = Reader(BytesIO(data))
+        for n in widths:
+            r.read_bits(n)
+
+    def write_bits():
+        w = Writer(BytesIO())
+        for v, n in zip(values, widths):
+            w.write_bits(v, n)
+        w.flush()
+
+    stamp = Template(data)  # already has a good checksum, and parsed stays unchanged
+    units = [(i, i) for i in range(64)]
+
+    def compact_strings():
+        s = sii.from_bytes(data, lazy=True)
+        s.compact_strings()
+
+    return {
+        'read_bits': (read_bits, len(data)),
+        'write_bits': (write_bits, len(data)),
+        'take': (lambda: sii.from_bytes(data), len(data)),
+        'take_lazy': (lambda: sii.from_bytes(data, lazy=True), len(data)),
+        'put': (lambda: sii.to_bytes(fresh), len(data)),
+        'put_unchanged': (lambda: sii.to_bytes(parsed), len(data)),
+        'compact_strings': (compact_strings, len(data)),
+        'str': (lambda: str(parsed), len(data)),
+        'stamp': (lambda: stamp.write_many(units, BytesIO()), len(data) * len(units)),
+    }
+
+
+def measure(fn, min_time=0.2, repeat=3):
+    '''Best seconds per call over a few timing runs of at least min_time each'''
+    best = None
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        per_call = elapsed / calls
+        best = per_call if best == None else min(best, per_call)
+    return best
+
+
+def peak_memory(fn):
+    '''Peak bytes allocated by one call'''
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes=None, names=None, min_time=0.2, repeat=3):
+    '''Run benchmarks, returning a list of result dicts'''
+    results = []
+    for size in sizes or SIZES:
+        data = synthetic_image(**SIZES[size])
+        for name, (fn, nbytes) in benchmarks(data).items():
+            if names and name not in names:
+                continue
+            seconds = measure(fn, min_time, repeat)
+            results.append({
+                'benchmark': name,
+                'size': size,
+                'image_bytes': len(data),
+                'seconds_per_image': seconds,
+                'images_per_sec': 1 / seconds,
+                'bytes_per_sec': nbytes / seconds,
+                'peak_memory_bytes': peak_memory(fn),
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', help='Write JSON results here (default stdout)')
+    parser.add_argument('--size', action='append', choices=tuple(SIZES),
+                        help='Image sizes to run (default all)')
+    parser.add_argument('--bench', action='append',
+                        help='Benchmarks to run (default all)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Seconds each timing run lasts at least')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.bench, args.min_time, args.repeat)
+    for r in results:
+        print('{benchmark:>16} {size:>7} {images_per_sec:12.1f} images/s '
+              '{bytes_per_sec:14.0f} B/s {peak_memory_bytes:10d} B peak'.format(**r),
+              file=sys.stderr)
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
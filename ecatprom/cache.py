@@ -0,0 +1,108 @@
+'''Content addressed cache of decoded categories
+
+Devices of the same product mostly carry byte for byte identical categories,
+so across a fleet each distinct payload only needs decoding once. Entries are
+keyed by (category type, hash of the payload).
+'''
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+
+from . import sii
+from .basictypes import BufferReader, walk
+from .export import leaf_value
+
+
+def payload_key(cat_id, raw):
+    return cat_id, hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class CategoryCache:
+    '''LRU cache of decoded categories and their flattened field records
+
+    Each image gets its own copy of a decoded category, so editing one image
+    never shows up in another. General and the RECORDS categories decode
+    through a codec faster than they copy, so decode never caches those. Records ([(field, value)] as written by export)
+    can also be kept in an SQLite file so they survive between runs.
+    '''
+
+    def __init__(self, maxsize=1024, path=None):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._records = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute('CREATE TABLE IF NOT EXISTS records ('
+                             'category INTEGER, digest BLOB, fields TEXT, '
+                             'PRIMARY KEY (category, digest))')
+
+    def _lookup(self, table, key):
+        try:
+            v = table[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        table.move_to_end(key)
+        self.hits += 1
+        return v
+
+    def _store(self, table, key, v):
+        table[key] = v
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+
+    def decode(self, cat_id, raw):
+        '''Decoded category for a payload, decoding it only if not seen before
+
+        Returns a fresh copy every time, safe to edit
+        '''
+        if cat_id == sii.CatType.General or cat_id in sii.RECORDS:
+            _, decode, _ = sii.CATEGORIES[cat_id]
+            return decode(BufferReader(raw))
+        return self._decoded(cat_id, raw).copy()
+
+    def _decoded(self, cat_id, raw):
+        '''The cached item itself, never hand it out'''
+        key = payload_key(cat_id, raw)
+        item = self._lookup(self._items, key)
+        if item == None:
+            _, decode, _ = sii.CATEGORIES[cat_id]
+            item = decode(BufferReader(raw))
+            self._store(self._items, key, item)
+        return item
+
+    def records(self, cat_id, raw):
+        '''[(field, value)] for a payload, from memory, disk or by decoding it'''
+        key = payload_key(cat_id, raw)
+        fields = self._lookup(self._records, key)
+        if fields != None:
+            return fields
+        if self._db:
+            row = self._db.execute('SELECT fields FROM records WHERE category=? AND digest=?',
+                                   key).fetchone()
+            if row:
+                fields = [tuple(f) for f in json.loads(row[0])]
+        if fields == None:
+            fields = [('.'.join(str(p) for p in path), leaf_value(leaf))
+                      for path, leaf in walk(self._decoded(cat_id, raw))]
+            if self._db:
+                self._db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                                 key + (json.dumps(fields),))
+        self._store(self._records, key, fields)
+        return fields
+
+    def close(self):
+        if self._db:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,23 +1,248 @@
+import argparse
+import sys
+
 from . import sii
-from . import gui
+from . import batch
+from . import export
+from . import diff
+from . import fleet
+from . import template
+from .cache import CategoryCache
+from .parsecache import ParseCache
+
+
+def _cache_args(parser):
+    parser.add_argument('--cache', action='store_true',
+                        help='Reuse results for files unchanged since the last run')
+    parser.add_argument('--cache-file', metavar='FILE',
+                        help='Where to keep those results (implies --cache, '
+                        'default under $XDG_CACHE_HOME)')
+
+
+def _open_cache(args):
+    if args.cache or args.cache_file:
+        return ParseCache(args.cache_file)
+    return None
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='ecatprom batch',
+        description='Print a one line summary of many SII PROM files')
+    parser.add_argument('paths', nargs='+',
+                        help='Files, or directories searched for *.bin files')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Worker processes to use (default one per core)')
+    parser.add_argument('--chunksize', type=int, default=32,
+                        help='Files handed to a worker at a time')
+    _cache_args(parser)
+    args = parser.parse_args(argv)
+
+    cache = _open_cache(args)
+    try:
+        return _batch(args, cache)
+    finally:
+        if cache:
+            cache.close()
+
+
+def _batch(args, cache):
+    print('path\tvendor_id\tproduct_code\trevision\tserial\talias\tname\tcategories')
+    failed = False
+    for r in batch.parse_many(batch.find_images(args.paths), args.jobs, args.chunksize,
+                               cache):
+        print(batch.format_summary(r))
+        failed = failed or bool(r.error)
+    return 1 if failed else 0
+
+
+def export_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='ecatprom export',
+        description='Dump SII PROM contents as NDJSON or CSV on stdout')
+    parser.add_argument('paths', nargs='+',
+                        help='Files, or directories searched for *.bin files')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--per', choices=('file', 'category'), default='file',
+                        help='What each NDJSON object describes')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Flatten each distinct category payload only once')
+    parser.add_argument('--dedup-db', metavar='FILE',
+                        help='Keep flattened categories in this SQLite file between runs '
+                        '(implies --dedup)')
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.dedup or args.dedup_db:
+        cache = CategoryCache(path=args.dedup_db)
+    paths = batch.find_images(args.paths)
+    try:
+        if args.format == 'csv':
+            export.write_csv(paths, sys.stdout, cache)
+        else:
+            export.write_ndjson(paths, sys.stdout, args.per, cache)
+    finally:
+        if cache:
+            cache.close()
+    return 0
+
+
+def index_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='ecatprom index',
+        description='Add SII PROM files to a SQLite index, re-reading only changed ones')
+    parser.add_argument('db', help='Index file, created if needed')
+    parser.add_argument('paths', nargs='+',
+                        help='Files, or directories searched for *.bin files')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Worker processes to use (default one per core)')
+    parser.add_argument('--prune', action='store_true',
+                        help='Drop indexed files that no longer exist')
+    args = parser.parse_args(argv)
+
+    with fleet.FleetIndex(args.db) as db:
+        read, fresh, removed = db.update(batch.find_images(args.paths), args.jobs,
+                                         prune=args.prune)
+    print('{} read, {} unchanged, {} removed'.format(read, fresh, removed))
+    return 0
+
+
+def _int(s):
+    return int(s, 0)
+
+
+def query_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='ecatprom query',
+        description='Print the paths of indexed files matching all the conditions given',
+        epilog='Columns: images({}) syncm({})'.format(
+            ', '.join(fleet.TABLES['images']), ', '.join(fleet.TABLES['syncm'])))
+    parser.add_argument('db', help='Index made by ecatprom index')
+    parser.add_argument('--vendor', type=_int)
+    parser.add_argument('--product', type=_int)
+    parser.add_argument('--revision', type=_int)
+    parser.add_argument('--revision-below', type=_int)
+    parser.add_argument('--name')
+    parser.add_argument('--syncm-type', choices=list(sii.SYNCM_TYPES.values()),
+                        help='Has a sync manager of this type')
+    parser.add_argument('--syncm-start', type=_int,
+                        help='Has a sync manager at this address (of --syncm-type if given)')
+    parser.add_argument('--where', help='Extra SQL condition, sync manager columns as sm.<name>')
+    args = parser.parse_args(argv)
+
+    fields = {'vendor_id': args.vendor, 'product_code': args.product,
+              'revision_number': args.revision, 'name': args.name,
+              'syncm_sync_manager_type': args.syncm_type,
+              'syncm_physical_start_addr': args.syncm_start}
+    where = [args.where] if args.where else []
+    params = []
+    if args.revision_below != None:
+        where.append('images.revision_number < ?')
+        params.append(args.revision_below)
+    with fleet.FleetIndex(args.db) as db:
+        paths = db.find(' AND '.join(where) or None, params,
+                        **{k: v for k, v in fields.items() if v != None})
+    for p in paths:
+        print(p)
+    return 0 if paths else 1
+
+
+def diff_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='ecatprom diff',
+        description='Print the fields of SII PROM files that differ from a golden image')
+    parser.add_argument('golden')
+    parser.add_argument('paths', nargs='+',
+                        help='Files, or directories searched for *.bin files')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Worker processes to use (default one per core)')
+    parser.add_argument('--chunksize', type=int, default=32,
+                        help='Files handed to a worker at a time')
+    args = parser.parse_args(argv)
+
+    with open(args.golden, 'rb') as f:
+        golden = f.read()
+    differs = False
+    for path, changes, error in diff.diff_many(golden, batch.find_images(args.paths),
+                                               args.jobs, args.chunksize):
+        if error:
+            print('{}\tERROR\t{}'.format(path, error))
+        for c in changes:
+            print('{}\t{}'.format(path, diff.format_change(c)))
+        differs = differs or bool(error or changes)
+    return 1 if differs else 0
+
+
+def stamp_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='ecatprom stamp',
+        description='Make per unit images from a golden image, with their own serial '
+        'numbers and aliases and a fixed checksum')
+    parser.add_argument('golden')
+    parser.add_argument('out', help='Output file getting all images back to back, or '
+                        'a name pattern like unit_{serial}.bin for a file per image')
+    parser.add_argument('--serial', type=_int, required=True, help='First serial number')
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--alias', type=_int, default=None,
+                        help='First configured alias (default as in the golden image)')
+    parser.add_argument('--alias-step', type=_int, default=0,
+                        help='Added to the alias for each unit')
+    args = parser.parse_args(argv)
+
+    with open(args.golden, 'rb') as f:
+        t = template.Template(f.read())
+    serial, alias = t.golden_values()
+    alias = alias if args.alias == None else args.alias
+    rows = ((args.serial + i, alias + i * args.alias_step) for i in range(args.count))
+    if '{' in args.out:
+        for serial, alias in rows:
+            with open(args.out.format(serial=serial, alias=alias), 'wb') as f:
+                f.write(t.render((serial, alias)))
+    else:
+        with open(args.out, 'wb') as f:
+            t.write_many(rows, f)
+    return 0
+
+
+# subcommands, picked by the first argument
+COMMANDS = {
+    'batch': batch_main,
+    'export': export_main,
+    'index': index_main,
+    'query': query_main,
+    'diff': diff_main,
+    'stamp': stamp_main,
+}
+
 
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        sys.exit(COMMANDS[argv[0]](argv[1:]))
 
-def main():
-    import argparse
     parser = argparse.ArgumentParser(
-        description='View and edit SII PROM contents')
+        description='View and edit SII PROM contents',
+        epilog='Other commands: {} (see ecatprom <command> --help)'.format(
+            ', '.join(COMMANDS)))
     parser.add_argument('eeprom_file', nargs='?')
     parser.add_argument('--no-gui', action='store_true',
                         help='Just print the contents to the terminal')
-    args = parser.parse_args()
+    _cache_args(parser)
+    args = parser.parse_args(argv)
 
     if args.no_gui:
         if args.eeprom_file:
             print(args.eeprom_file)
-            s = sii.from_file(args.eeprom_file)
-            print(s)
+            cache = _open_cache(args)
+            if cache:
+                with cache:
+                    print(cache.report(args.eeprom_file))
+            else:
+                print(sii.from_file(args.eeprom_file))
 
     else:
+        from . import gui  # needs tkinter, which headless installs may lack
         gui.main(args.eeprom_file)
 
 
@@ -0,0 +1,92 @@
+'''CRC-8 of the SII config area (words 0 to 6), stored in the low byte of word 7
+
+Polynomial x^8 + x^2 + x + 1, initial value 0xFF, no reflection, as the ESC
+expects when it loads the config data.
+'''
+
+POLY = 0x07
+INIT = 0xFF
+CONFIG_BYTES = 14  # bytes covered by the checksum
+CHECKSUM_OFFSET = 14  # byte offset of the checksum word
+
+
+def _make_table():
+    table = []
+    for b in range(256):
+        crc = b
+        for _ in range(8):
+            crc = ((crc << 1) ^ POLY if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+_table = _make_table()
+
+
+def crc8(data, crc=INIT):
+    '''Table driven CRC-8 of some bytes'''
+    for b in data:
+        crc = _table[crc ^ b]
+    return crc
+
+
+# The CRC is affine in the data, so for a fixed length it is the CRC of all
+# zeros xored with a contribution from each byte that only depends on the byte
+# and its position. That lets config_crc_many work on columns of bytes.
+_zero_crc = crc8(bytes(CONFIG_BYTES))
+_positions = [
+    bytes(crc8(bytes(i) + bytes([b]) + bytes(CONFIG_BYTES - i - 1), 0)
+          for b in range(256))
+    for i in range(CONFIG_BYTES)
+]
+
+
+def config_crc(image):
+    '''Checksum for the config area at the start of an image'''
+    if len(image) < CONFIG_BYTES:
+        raise ValueError('Need {} bytes of config data'.format(CONFIG_BYTES))
+    return crc8(image[:CONFIG_BYTES])
+
+
+def config_crc_many(images):
+    '''Checksums for many images at once, as bytes with one CRC per image
+
+    Rather than looping over every byte of every image, each byte position is
+    pulled out of all images in one slice, mapped through a lookup table with
+    bytes.translate and folded in with a single big integer xor
+    '''
+    heads = [bytes(i[:CONFIG_BYTES]) for i in images]
+    if any(len(h) != CONFIG_BYTES for h in heads):
+        raise ValueError('Need {} bytes of config data'.format(CONFIG_BYTES))
+    blob = b''.join(heads)
+    n = len(heads)
+    acc = int.from_bytes(bytes([_zero_crc]) * n, 'little')
+    for i, table in enumerate(_positions):
+        acc ^= int.from_bytes(blob[i::CONFIG_BYTES].translate(table), 'little')
+    return acc.to_bytes(n, 'little')
+
+
+def config_crc_delta(offset, old, new):
+    '''What the config CRC gets xored with when bytes at offset change from old to new
+
+    Bytes outside the config area do not count
+    '''
+    delta = 0
+    for i, (a, b) in enumerate(zip(old, new), offset):
+        if i < CONFIG_BYTES:
+            delta ^= _positions[i][a] ^ _positions[i][b]
+    return delta
+
+
+def stored_checksum(image):
+    '''Checksum word as stored in an image'''
+    return int.from_bytes(image[CHECKSUM_OFFSET:CHECKSUM_OFFSET + 2], 'little')
+
+
+def check_images(images):
+    '''Yield (position, stored, computed) for every image with a bad checksum'''
+    images = list(images)
+    for i, (image, crc) in enumerate(zip(images, config_crc_many(images))):
+        stored = stored_checksum(image)
+        if stored != crc:
+            yield i, stored, crc
@@ -0,0 +1,123 @@
+'''Field by field differences between SII images
+
+Categories whose raw bytes are the same on both sides are skipped without
+being decoded, so comparing a lazily taken golden image against lots of
+mostly identical dumps only decodes what actually differs.
+'''
+from collections import namedtuple
+from functools import partial
+
+from . import sii
+from .basictypes import Struct, Array, NullBytes, walk
+from .batch import map_workers
+from .export import leaf_value
+
+# field is the dotted path inside the category, old or new is None where the
+# field only exists on one side
+Change = namedtuple('Change', 'category field old new')
+
+
+def _raw(s, name):
+    raw = s.raw_payloads(name)
+    if isinstance(raw, list):
+        return b''.join(raw)
+    return raw
+
+
+def _field(path):
+    return '.'.join(str(p) for p in path)
+
+
+def _one_sided(category, item, path, old):
+    for p, leaf in walk(item, path):
+        v = leaf_value(leaf)
+        yield Change(category, _field(p), v if old else None, None if old else v)
+
+
+def diff_items(category, a, b, path=()):
+    '''Yield a Change for each leaf that differs between two items of the same layout'''
+    if a is b:
+        return
+    if isinstance(a, Array) and isinstance(b, Array):
+        for i in range(max(len(a), len(b))):
+            if i >= len(b):
+                yield from _one_sided(category, a[i], path + (i,), True)
+            elif i >= len(a):
+                yield from _one_sided(category, b[i], path + (i,), False)
+            else:
+                yield from diff_items(category, a[i], b[i], path + (i,))
+    elif isinstance(a, Struct) and type(a) == type(b):
+        for k, v in a._members.items():
+            other = b._members.get(k)
+            if other == None:
+                yield from _one_sided(category, v, path + (k,), True)
+            else:
+                yield from diff_items(category, v, other, path + (k,))
+        for k, v in b._members.items():
+            if k not in a._members:
+                yield from _one_sided(category, v, path + (k,), False)
+    elif isinstance(a, Struct) or isinstance(b, Struct):
+        yield from _one_sided(category, a, path, True)
+        yield from _one_sided(category, b, path, False)
+    elif not isinstance(a, NullBytes):
+        old, new = leaf_value(a), leaf_value(b)
+        if old != new:
+            yield Change(category, _field(path), old, new)
+
+
+def diff(a, b):
+    '''Yield a Change for every field that differs between two Sii'''
+    for name in ['info'] + [n for n, _, _ in sii.CATEGORIES.values()]:
+        raw = _raw(a, name)
+        if raw != None and raw == _raw(b, name):
+            continue
+        x, y = getattr(a, name), getattr(b, name)
+        if x == None and y == None:
+            continue
+        if x == None:
+            yield from _one_sided(name, y, (), False)
+        elif y == None:
+            yield from _one_sided(name, x, (), True)
+        else:
+            yield from diff_items(name, x, y)
+
+    unknown_a, unknown_b = {}, {}
+    for cat_id, data in a.unknown:
+        unknown_a.setdefault(cat_id, []).append(data)
+    for cat_id, data in b.unknown:
+        unknown_b.setdefault(cat_id, []).append(data)
+    for cat_id in sorted(set(unknown_a) | set(unknown_b)):
+        old, new = unknown_a.get(cat_id, []), unknown_b.get(cat_id, [])
+        for i in range(max(len(old), len(new))):
+            x = old[i].hex() if i < len(old) else None
+            y = new[i].hex() if i < len(new) else None
+            if x != y:
+                yield Change('0x{:04X}'.format(cat_id), 'raw.{}'.format(i), x, y)
+
+
+# per process, the golden image last compared against
+_golden = (None, None)
+
+
+def diff_file(golden, path):
+    '''(path, list of Changes from the golden image bytes, error or None)'''
+    global _golden
+    if _golden[0] != golden:
+        _golden = (golden, sii.from_bytes(golden, lazy=True))
+    try:
+        s = sii.from_file(path, lazy=True)
+        return path, list(diff(_golden[1], s)), None
+    except Exception as e:
+        return path, [], '{}: {}'.format(type(e).__name__, e)
+
+
+def diff_many(golden, paths, workers=None, chunksize=32):
+    '''Yield diff_file results of many files against a golden image, in order
+
+    golden - bytes of the golden image
+    '''
+    return map_workers(partial(diff_file, golden), paths, workers, chunksize)
+
+
+def format_change(c):
+    return '{}.{}: {!r} -> {!r}'.format(c.category, c.field, c.old, c.new)
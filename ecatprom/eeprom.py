@@ -0,0 +1,163 @@
+'''Reading and writing SII images on things only reachable a word range at a time
+
+An EepromSource has a read_words coroutine, an EepromSink a write_words one,
+both addressing 16 bit words like the ESC does. Latency is assumed to be what
+hurts, so read_sii gets the info block first, then walks the category headers
+and starts fetching each wanted payload as soon as its header is seen.
+Everything is a coroutine so many devices can be read at once, see read_many.
+'''
+import abc
+import asyncio
+import struct
+
+from . import sii
+from .basictypes import BufferReader, OutOfBytesError, codec_for
+from .sii import CatType, IndexEntry, InfoStructure, SiiIndex
+
+INFO_WORDS = SiiIndex.INFO_WORDS
+_header = struct.Struct('<HH')
+
+
+class EepromSource(abc.ABC):
+    '''Something SII words can be read from'''
+
+    @abc.abstractmethod
+    async def read_words(self, address, count):
+        '''bytes of count words starting at word address'''
+
+
+class EepromSink(abc.ABC):
+    '''Something SII words can be written to'''
+
+    @abc.abstractmethod
+    async def write_words(self, address, data):
+        '''Write bytes (a whole number of words) starting at word address'''
+
+
+class FileEeprom(EepromSource, EepromSink):
+    '''An image file, the blocking I/O runs in the default executor'''
+
+    def __init__(self, path):
+        self.path = path
+
+    async def read_words(self, address, count):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._read, address, count)
+
+    async def write_words(self, address, data):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, address, data)
+
+    def _read(self, address, count):
+        with open(self.path, 'rb') as f:
+            f.seek(2*address)
+            data = f.read(2*count)
+        if len(data) != 2*count:
+            raise OutOfBytesError()
+        return data
+
+    def _write(self, address, data):
+        with open(self.path, 'r+b') as f:
+            f.seek(2*address)
+            f.write(data)
+
+
+class SimulatedEeprom(EepromSource, EepromSink):
+    '''An image in memory that takes latency seconds to answer each request
+
+    Counts requests and words moved, for testing how much a reader fetches
+    '''
+
+    def __init__(self, data, latency=0.01):
+        self.data = bytearray(data)
+        self.latency = latency
+        self.requests = 0
+        self.words_read = 0
+        self.words_written = 0
+
+    async def read_words(self, address, count):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if 2*(address + count) > len(self.data):
+            raise OutOfBytesError()
+        self.words_read += count
+        return bytes(self.data[2*address:2*(address + count)])
+
+    async def write_words(self, address, data):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        self.data[2*address:2*address + len(data)] = data
+        self.words_written += len(data) // 2
+
+
+async def read_info(source):
+    '''Info block of the image on a source, in one request'''
+    data = await source.read_words(0, INFO_WORDS)
+    return codec_for(InfoStructure).take(BufferReader(data))
+
+
+async def read_sii(source, categories=None):
+    '''Lazily taken Sii of the image on a source
+
+    categories - category types to fetch, by default all of them. Others are
+                 only recorded as skipped, see sii.from_parts
+    '''
+    first = await source.read_words(0, INFO_WORDS + 2)
+    header = first[-4:]
+    word = INFO_WORDS
+    entries = []
+    fetches = []
+    try:
+        while True:
+            cat_id, nwords = _header.unpack(header)
+            if cat_id == CatType.END:
+                break
+            entries.append(IndexEntry(cat_id, word + 2, nwords))
+            if categories == None or cat_id in categories:
+                fetches.append((entries[-1], asyncio.ensure_future(
+                    source.read_words(word + 2, nwords))))
+            word += 2 + nwords
+            header = await source.read_words(word, 2)
+        payloads = await asyncio.gather(*(f for _, f in fetches))
+    except BaseException:
+        for _, f in fetches:
+            f.cancel()
+        raise
+    return sii.from_parts(first[:-4], SiiIndex(entries),
+                          {e: p for (e, _), p in zip(fetches, payloads)}, lazy=True)
+
+
+async def write_sii(sink, s, original=None, fix_checksum=False, max_words=256):
+    '''Write an Sii to a sink, with all the writes in flight at once
+
+    original - what the sink is known to hold, only the differing words are
+               written if given
+    max_words - largest single write
+    Categories a filtered read_sii skipped are never written
+    Returns the word patch that was applied, or None if everything was written
+    '''
+    if original == None:
+        patch = None
+        regions = s.regions(fix_checksum)
+    else:
+        patch = sii.word_patch(original, sii.overlay(s, original, fix_checksum))
+        regions = sii.patch_runs(patch)
+    runs = []
+    for addr, data in regions:
+        for i in range(0, len(data), 2*max_words):
+            runs.append((addr + i // 2, data[i:i + 2*max_words]))
+    await asyncio.gather(*(sink.write_words(addr, data) for addr, data in runs))
+    return patch
+
+
+async def read_many(fn, sources, limit=64):
+    '''Run a coroutine function over many sources at once, at most limit at a time
+
+    Returns a list in source order holding each result, or the exception raised
+    '''
+    sem = asyncio.Semaphore(limit)
+
+    async def one(source):
+        async with sem:
+            return await fn(source)
+
+    return await asyncio.gather(*(one(s) for s in sources), return_exceptions=True)
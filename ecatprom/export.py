@@ -0,0 +1,94 @@
+'''Machine readable dumps of SII contents, written record by record
+
+Nothing bigger than a single record is held in memory so any number of files
+can be piped through.
+'''
+import csv
+import json
+
+from . import sii
+from .basictypes import walk, Enum
+
+
+def leaf_value(leaf):
+    '''Plain python value of a leaf: enum label (or code if unknown), int or str'''
+    if isinstance(leaf, Enum) and leaf.value == None:
+        return leaf._value
+    return leaf.value
+
+
+def iter_fields(s, cache=None):
+    '''Yield (category, field, value) for everything in an Sii
+
+    field is the dotted path inside the category. Categories we cant decode
+    get a single 'raw' field holding their bytes as hex. With a
+    cache.CategoryCache, categories still as they were taken are flattened
+    once per distinct payload (and a lazily taken Sii never decodes them)
+    '''
+    for path, leaf in walk(s.info):
+        yield 'info', '.'.join(str(p) for p in path), leaf_value(leaf)
+    for cat_id, (name, _, _) in sii.CATEGORIES.items():
+        payloads = s.raw_payloads(name) if cache else None
+        if payloads != None:
+            for field, value in cache.records(cat_id, b''.join(payloads)):
+                yield name, field, value
+            continue
+        item = getattr(s, name)
+        if item == None:
+            continue
+        for path, leaf in walk(item):
+            yield name, '.'.join(str(p) for p in path), leaf_value(leaf)
+    for cat_id, data in s.unknown:
+        yield '0x{:04X}'.format(cat_id), 'raw', data.hex()
+
+
+def iter_records(s, source=None, per='file', cache=None):
+    '''Yield flat dicts describing an Sii, one per file or one per category'''
+    record = None
+    for category, field, value in iter_fields(s, cache):
+        if per == 'category':
+            if record == None or record['category'] != category:
+                if record != None:
+                    yield record
+                record = {'file': source, 'category': category}
+            record[field] = value
+        else:
+            if record == None:
+                record = {'file': source}
+            record[category + '.' + field] = value
+    if record != None:
+        yield record
+
+
+def _parse_all(paths, cache=None):
+    '''Yield (path, Sii or None, error message or None)'''
+    for p in paths:
+        try:
+            yield p, sii.from_file(p, lazy=cache != None), None
+        except Exception as e:
+            yield p, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def write_ndjson(paths, fp, per='file', cache=None):
+    '''Write one JSON object per line for each file (or category of a file)'''
+    for p, s, error in _parse_all(paths, cache):
+        if error:
+            fp.write(json.dumps({'file': p, 'error': error}) + '\n')
+            continue
+        for record in iter_records(s, p, per, cache):
+            fp.write(json.dumps(record) + '\n')
+
+
+def write_csv(paths, fp, cache=None):
+    '''Write a file,category,field,value row for every value in each file
+
+    One row per value keeps the columns fixed however different the files are
+    '''
+    w = csv.writer(fp)
+    w.writerow(('file', 'category', 'field', 'value'))
+    for p, s, error in _parse_all(paths, cache):
+        if error:
+            w.writerow((p, '', 'error', error))
+            continue
+        for category, field, value in iter_fields(s, cache):
+            w.writerow((p, category, field, value))
@@ -0,0 +1,176 @@
+'''Index the identity and configuration of many SII images in SQLite
+
+Each file gets a row in images (Info identity, the general category flattened
+into general_* columns and its name strings), one row per sync manager in
+syncm, per FMMU in fmmu and per string in strings, all keyed by path. Indexing
+again only re-reads files whose size or modification time changed, so queries
+like "vendor X, revision < Z with a MBX_OUT sync manager at 0x1000" are a
+single SELECT.
+'''
+from collections import namedtuple
+import os
+import sqlite3
+
+from . import sii
+from .basictypes import walk
+from .batch import map_workers
+from .export import leaf_value
+
+
+def _flat(item):
+    '''{column name: value} for the leaves of an item'''
+    return {'_'.join(str(p) for p in path): leaf_value(leaf) for path, leaf in walk(item)}
+
+
+IDENTITY = ['vendor_id', 'product_code', 'revision_number', 'serial_number']
+GENERAL = ['general_' + c for c in _flat(sii.CategoryGeneral())]
+SYNCM = list(_flat(sii.SyncM()))
+
+# per table, the columns after path, in order
+TABLES = {
+    'images': ['size', 'mtime_ns', 'error'] + IDENTITY +
+              ['configured_alias', 'name', 'group_name', 'order_name'] + GENERAL,
+    'syncm': ['n'] + SYNCM,
+    'fmmu': ['n', 'usage'],
+    'strings': ['n', 'value'],
+}
+
+INDEXES = [
+    'images(vendor_id, product_code, revision_number)',
+    'images(name)',
+    'syncm(sync_manager_type, physical_start_addr)',
+    'syncm(path)',
+    'fmmu(path)',
+    'strings(value)',
+    'strings(path)',
+]
+
+# rows of one file, per table
+Rows = namedtuple('Rows', 'path images syncm fmmu strings')
+
+
+def scan(path):
+    '''Read a file into table rows, a file that wont parse gets just its error'''
+    st = os.stat(path)
+    image = dict.fromkeys(TABLES['images'])
+    image.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+    rows = Rows(path, [image], [], [], [])
+    try:
+        s = sii.from_file(path, lazy=True)
+        image.update((k, v.value) for k, v in s.info.id._members.items())
+        image.update(configured_alias=s.info.configured_alias.value,
+                     name=s.general_name,
+                     group_name=s.general_group,
+                     order_name=s.general_order)
+        if s.general != None:
+            image.update(('general_' + k, v) for k, v in _flat(s.general).items())
+        for n, sm in enumerate(s.syncm or ()):
+            rows.syncm.append(dict(_flat(sm), n=n))
+        for n, f in enumerate(s.fmmu or ()):
+            rows.fmmu.append({'n': n, 'usage': leaf_value(f)})
+        for n, string in enumerate(s.strings or (), 1):
+            rows.strings.append({'n': n, 'value': string.value})
+    except Exception as e:
+        del rows.syncm[:], rows.fmmu[:], rows.strings[:]
+        image.update(dict.fromkeys(TABLES['images'][3:]),
+                     error='{}: {}'.format(type(e).__name__, e))
+    return rows
+
+
+class FleetIndex:
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        for table, columns in TABLES.items():
+            self._db.execute('CREATE TABLE IF NOT EXISTS {} (path TEXT, {})'.format(
+                table, ', '.join(columns)))
+        self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS images_path ON images(path)')
+        for i, spec in enumerate(INDEXES):
+            self._db.execute('CREATE INDEX IF NOT EXISTS idx{} ON {}'.format(i, spec))
+
+    def update(self, paths, workers=None, chunksize=32, prune=False):
+        '''Index new and changed files, returns (files read, files unchanged, files removed)
+
+        prune - also drop files that are indexed but no longer exist
+        '''
+        known = dict((p, (size, mtime)) for p, size, mtime in
+                     self._db.execute('SELECT path, size, mtime_ns FROM images'))
+        stale, fresh = [], 0
+        for p in paths:
+            p = os.path.abspath(p)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            if known.get(p) == (st.st_size, st.st_mtime_ns):
+                fresh += 1
+            else:
+                stale.append(p)
+        for rows in map_workers(scan, stale, workers, chunksize):
+            self._remove(rows.path)
+            for table in TABLES:
+                self._insert(table, rows.path, getattr(rows, table))
+        removed = 0
+        if prune:
+            for p in known:
+                if not os.path.exists(p):
+                    self._remove(p)
+                    removed += 1
+        self._db.commit()
+        return len(stale), fresh, removed
+
+    def _remove(self, path):
+        for table in TABLES:
+            self._db.execute('DELETE FROM {} WHERE path=?'.format(table), (path,))
+
+    def _insert(self, table, path, rows):
+        columns = TABLES[table]
+        sql = 'INSERT INTO {} VALUES (?{})'.format(table, ', ?' * len(columns))
+        self._db.executemany(sql, ([path] + [r.get(c) for c in columns] for r in rows))
+
+    def find(self, where=None, params=(), **fields):
+        '''Paths of the images matching, in path order
+
+        fields - column=value tests on the images table, and syncm_<column>=value
+                 for images with a sync manager matching all those given
+        where - any extra SQL condition, syncm columns are available as sm.<column>
+        '''
+        conds, args = [], []
+        sm = {}
+        for k, v in fields.items():
+            if k.startswith('syncm_') and k[6:] in TABLES['syncm']:
+                sm[k[6:]] = v
+            elif k in TABLES['images']:
+                conds.append('images.{}=?'.format(k))
+                args.append(v)
+            else:
+                raise KeyError(k)
+        sql = 'SELECT DISTINCT images.path FROM images'
+        if sm or (where and 'sm.' in where):
+            sql += ' JOIN syncm sm ON sm.path = images.path'
+            for k, v in sm.items():
+                conds.append('sm.{}=?'.format(k))
+                args.append(v)
+        if where:
+            conds.append('(' + where + ')')
+            args.extend(params)
+        if conds:
+            sql += ' WHERE ' + ' AND '.join(conds)
+        sql += ' ORDER BY images.path'
+        return [p for p, in self._db.execute(sql, args)]
+
+    def execute(self, sql, params=()):
+        '''Run any SQL against the index'''
+        return self._db.execute(sql, params)
+
+    def close(self):
+        if self._db:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
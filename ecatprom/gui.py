@@ -7,66 +7,121 @@ from . import sii
 from . import basictypes
 
 
-def mk_widget(parent, item):
+def display(item):
+    '''(value, hex) columns of an items tree row'''
     if isinstance(item, basictypes.Enum):
-        e1 = ttk.Combobox(parent)
-        e1['values'] = list(item.options.values())
-        e1.set(item.value)
+        return (item._value if item.value == None else item.value, '')
+    if isinstance(item, basictypes.Int):
+        return (item.value, '0x{:X}'.format(item.value) if item.bits > 1 else '')
+    if isinstance(item, basictypes.Struct):
+        return ('', '')
+    return (str(getattr(item, 'value', item)), '')
+
+
+class ItemTree(ttk.Frame):
+    '''Treeview of items
 
-        def update(_):
+    Rows are only made when their parent is first opened and an editor widget
+    only exists while a value is being edited, so big images stay quick
+    '''
+
+    def __init__(self, parent, roots):
+        ttk.Frame.__init__(self, parent)
+        self.tree = ttk.Treeview(self, columns=('value', 'hex'))
+        self.tree.heading('#0', text='Field', anchor=W)
+        self.tree.heading('value', text='Value', anchor=W)
+        self.tree.heading('hex', text='Hex', anchor=W)
+        scroll = ttk.Scrollbar(self, orient=VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scroll.set)
+        self.tree.pack(side=LEFT, fill=BOTH, expand=1)
+        scroll.pack(side=RIGHT, fill=Y)
+        self.items = {}  # row id -> item
+        self.rows = {}  # id(item) -> row id
+        self.editor = None
+        for name, item in roots:
+            iid = self.insert('', name, item)
+            if len(roots) == 1:
+                self.expand(iid)
+                self.tree.item(iid, open=True)
+        self.tree.bind('<<TreeviewOpen>>', lambda _: self.expand(self.tree.focus()))
+        self.tree.bind('<Double-1>', lambda _: self.edit(self.tree.focus()))
+        self.tree.bind('<Return>', lambda _: self.edit(self.tree.focus()))
+        for seq in ('<<TreeviewSelect>>', '<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(seq, lambda _: self.close_editor(), add='+')
+
+    def insert(self, parent, name, item):
+        iid = self.tree.insert(parent, END, text=name, values=display(item))
+        self.items[iid] = item
+        self.rows[id(item)] = iid
+        if isinstance(item, basictypes.Struct) and len(item._members):
+            # placeholder so the row can be opened, swapped for the members on first open
+            self.tree.insert(iid, END, text='...')
+        return iid
+
+    def expand(self, iid):
+        item = self.items.get(iid)
+        children = self.tree.get_children(iid)
+        if len(children) != 1 or children[0] in self.items:
+            return  # not a struct or already done
+        self.tree.delete(children[0])
+        if isinstance(item, basictypes.Array):
+            members = enumerate(item._members)
+        else:
+            members = item._members.items()
+        for k, v in members:
+            if not isinstance(v, basictypes.NullBytes):
+                self.insert(iid, str(k), v)
+
+    def edit(self, iid):
+        self.close_editor()
+        item = self.items.get(iid)
+        if not isinstance(item, basictypes.Int):
+            return
+        if item.bits == 1 and not isinstance(item, basictypes.Enum):
+            item.value = 1 - item.value
+            self.refresh([item])
+            return
+        box = self.tree.bbox(iid, 'value')
+        if not box:
+            return
+        if isinstance(item, basictypes.Enum):
+            e = ttk.Combobox(self.tree, values=list(item.options.values()))
+            e.set(item.value)
+            e.bind('<<ComboboxSelected>>', lambda _: commit())
+        else:
+            e = ttk.Entry(self.tree)
+            e.insert(0, str(item.value))
+            e.select_range(0, END)
+
+        def commit(_=None):
             try:
-                item.value = e1.get()
+                if isinstance(item, basictypes.Enum):
+                    item.value = e.get()
+                else:
+                    item.value = int(e.get(), base=0)
             except:
-                print('Bad value', e1.get())
-                e1.set(item.value)
-        e1.bind('<<ComboboxSelected>>', update)
-        return (e1, None)
-    if isinstance(item, basictypes.Int):
-        if item.bits == 1:
-            v = IntVar(value=item.value)
-            cb = ttk.Checkbutton(parent, variable=v, command=lambda: v.get())
-
-            def update(*args):
-                item.value = v.get()
-                print(item)
-            v.trace("w", update)
-            return (cb, None)
-        else:
-            e1 = ttk.Entry(parent)
-            e1.insert(0, str(item.value))
-            # show in hex as well
-            e2 = ttk.Label(parent, text='0x{:X}'.format(item.value))
-
-            def update(key=None):
-                try:
-                    item.value = int(e1.get(), base=0)
-                except:
-                    print('Bad value', e1.get())
-                    item.value = 0
-                    if key and key.keysym == 'Return':
-                        e1.delete(0, END)
-                        e1.insert(0, str(item.value))
-                e2['text'] = '0x{:X}'.format(item.value)
-            e1.bind('<KeyRelease>', update)
-            return (e1, e2)
-    else:
-        return (ttk.Label(parent, text=str(item)), None)
-
-
-def add_item_row(parent, item, name, rownum=0, depth=0):
-    ttk.Label(parent, text="  " * depth + name).grid(column=0,
-                                                     row=rownum, sticky=W, padx=2)
-    rownum += 1
-    if isinstance(item, basictypes.Struct):
-        for k, v in item._members.items():
-            rownum = add_item_row(parent, v, k, rownum, depth + 1)
-    else:
-        a, b = mk_widget(parent, item)
-        if a:
-            a.grid(column=1, row=rownum-1, sticky=W, padx=2)
-        if b:
-            b.grid(column=2, row=rownum-1, sticky=W, padx=2)
-    return rownum
+                print('Bad value', e.get())
+            self.close_editor()
+            self.refresh([item])
+            self.tree.focus_set()
+
+        e.bind('<Return>', commit)
+        e.bind('<Escape>', lambda _: self.close_editor())
+        e.place(x=box[0], y=box[1], width=box[2], height=box[3])
+        e.focus_set()
+        self.editor = e
+
+    def close_editor(self):
+        if self.editor:
+            self.editor.destroy()
+            self.editor = None
+
+    def refresh(self, items):
+        '''Redisplay the rows of some items, those without rows yet are skipped'''
+        for item in items:
+            iid = self.rows.get(id(item))
+            if iid:
+                self.tree.item(iid, values=display(item))
 
 
 class App(ttk.Frame):
@@ -96,63 +151,59 @@ class App(ttk.Frame):
         self.mainframe.destroy()
         self.mainframe = ttk.Notebook(self)
         self.mainframe.pack(fill=BOTH, expand=1)
-        f = ttk.Frame(self, borderwidth=5)
-        self.mainframe.add(f, text='Info')
-        add_item_row(f, self.model.info, 'Info', 0)
+        self.builders = {}  # tab frame name -> what fills it, until first shown
+        self.trees = []
+        self.add_tab('Info', lambda: [('Info', self.model.info)])
         if self.model.general:
-            self.add_strings()
-            f = ttk.Frame(self)
-            self.mainframe.add(f, text='General')
-            add_item_row(f, self.model.general, 'General')
+            self.add_tab('Strings', build=self.add_strings)
+            self.add_tab('General', lambda: [('General', self.model.general)])
         if self.model.fmmu:
-            f = ttk.Frame(self)
-            self.mainframe.add(f, text='FMMU')
-            rownum = 0
-            for idx, fmmu in enumerate(self.model.fmmu):
-                rownum = add_item_row(f, fmmu, 'FMMU {}'.format(idx), rownum)
+            self.add_tab('FMMU', lambda: [('FMMU {}'.format(idx), fmmu)
+                                          for idx, fmmu in enumerate(self.model.fmmu)])
         if self.model.syncm:
-            f = ttk.Frame(self)
-            self.mainframe.add(f, text='SyncM')
-            rownum = 0
-            for idx, syncm in enumerate(self.model.syncm):
-                rownum = add_item_row(
-                    f, self.model.syncm[idx], 'SyncM {}'.format(idx), rownum)
+            self.add_tab('SyncM', lambda: [('SyncM {}'.format(idx), syncm)
+                                           for idx, syncm in enumerate(self.model.syncm)])
         if self.model.dc:
-            f = ttk.Frame(self)
-            self.mainframe.add(f, text='DC')
-            add_item_row(f, self.model.dc, 'DC')
-
-    def add_strings(self):
-        f = ttk.Frame(self)
-        self.mainframe.add(f, text='Strings')
-
-        row = 0
-        en = ttk.Entry(f)
-        en.insert(0, str(self.model.general_name))
-        en.grid(column=1, row=row)
-        ttk.Label(f, text="Name").grid(column=0, row=row)
-
-        row += 1
-        eg = ttk.Entry(f)
-        eg.insert(0, str(self.model.general_group))
-        eg.grid(column=1, row=row)
-        ttk.Label(f, text="Group").grid(column=0, row=row)
-
-        row += 1
-        eo = ttk.Entry(f)
-        eo.insert(0, str(self.model.general_order))
-        eo.grid(column=1, row=row)
-        ttk.Label(f, text="Order").grid(column=0, row=row)
+            self.add_tab('DC', lambda: [('DC {}'.format(idx), dc)
+                                        for idx, dc in enumerate(self.model.dc)])
+        self.mainframe.bind('<<NotebookTabChanged>>', self.build_tab)
+        self.build_tab()
+
+    def add_tab(self, text, roots=None, build=None):
+        '''Add a tab that gets filled on first show, with an ItemTree of roots by default'''
+        f = ttk.Frame(self.mainframe, borderwidth=5)
+        self.mainframe.add(f, text=text)
+        self.builders[str(f)] = build or (lambda f: self.add_tree(f, roots()))
+
+    def build_tab(self, _=None):
+        name = self.mainframe.select()
+        build = self.builders.pop(name, None)
+        if build:
+            build(self.mainframe.nametowidget(name))
+
+    def add_tree(self, parent, roots):
+        t = ItemTree(parent, roots)
+        t.pack(fill=BOTH, expand=1)
+        self.trees.append(t)
+
+    def add_strings(self, f):
+        entries = []
+        for row, what in enumerate(('name', 'group', 'order')):
+            e = ttk.Entry(f)
+            e.insert(0, str(getattr(self.model, 'general_' + what)))
+            e.grid(column=1, row=row)
+            ttk.Label(f, text=what.capitalize()).grid(column=0, row=row)
+            entries.append((what, e))
 
         def doit():
-            self.model.general_name = en.get()
-            self.model.general_group = eg.get()
-            self.model.general_order = eo.get()
-            # nuke it! This is shitty and slow but its the easy button right now
-            self.update_from_model()
-
-        row += 1
-        ttk.Button(f, command=doit, text='Set').grid(column=1, row=row)
+            for what, e in entries:
+                setattr(self.model, 'general_' + what, e.get())
+            # only the index fields can have changed, redisplay just those
+            refs = list(self.model.string_refs())
+            for t in self.trees:
+                t.refresh(refs)
+
+        ttk.Button(f, command=doit, text='Set').grid(column=1, row=len(entries))
 
     def open_file(self):
         fname = filedialog.askopenfilename()
@@ -0,0 +1,142 @@
+'''Persistent cache of parse results, so re-running over an unchanged archive is quick
+
+Entries are keyed by absolute path and checked against the file's size and
+modification time. When those changed but the content hash did not, the entry
+is refreshed rather than thrown away. Everything is stored as plain SQLite
+columns: the batch Summary as JSON, the SiiIndex in its dumps() form and,
+when asked for, the text report.
+
+The cache also records which parser made its contents (a hash of the source
+of the modules producing them), and is emptied when that changes, so an
+upgrade never serves output of the old code.
+'''
+from collections import namedtuple
+import hashlib
+import json
+import os
+import sqlite3
+
+from . import basictypes
+from . import batch
+from . import sii
+
+Scanned = namedtuple('Scanned', 'path size mtime_ns digest summary index')
+
+
+def default_path():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ecatprom', 'parse.sqlite')
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def parser_version():
+    '''Hash of the code that makes what the cache holds'''
+    h = hashlib.blake2b(digest_size=16)
+    for module in (basictypes, sii, batch):
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def scan(path):
+    '''Read and summarize a file, returning everything the cache stores'''
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        summary = batch.summarize_bytes(path, data)
+    except Exception as e:
+        summary = batch.Summary(path, None, None, None, None, None, None, (),
+                                '{}: {}'.format(type(e).__name__, e))
+    try:
+        index = sii.SiiIndex.build(data).dumps()
+    except Exception:
+        index = None
+    return Scanned(path, st.st_size, st.st_mtime_ns, _digest(data), summary, index)
+
+
+class ParseCache:
+
+    def __init__(self, path=None):
+        path = path or default_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                         'digest BLOB, summary TEXT, idx BLOB, report TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        version = parser_version()
+        row = self._db.execute("SELECT value FROM meta WHERE key='parser'").fetchone()
+        if row == None or row[0] != version:
+            self._db.execute('DELETE FROM files')
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('parser', ?)", (version,))
+            self._db.commit()
+
+    def _current(self, path):
+        '''Cached row for a file if it still matches what is on disk, else None'''
+        apath = os.path.abspath(path)
+        try:
+            st = os.stat(apath)
+        except OSError:
+            return None
+        row = self._db.execute('SELECT size, mtime_ns, digest, summary, idx, report '
+                               'FROM files WHERE path=?', (apath,)).fetchone()
+        if row == None:
+            return None
+        if (row[0], row[1]) != (st.st_size, st.st_mtime_ns):
+            with open(apath, 'rb') as f:
+                if _digest(f.read()) != row[2]:
+                    return None
+            # touched but not changed
+            self._db.execute('UPDATE files SET size=?, mtime_ns=? WHERE path=?',
+                             (st.st_size, st.st_mtime_ns, apath))
+        return row
+
+    def summary(self, path):
+        '''Cached batch.Summary of a file, None if there is no current one'''
+        row = self._current(path)
+        if row == None:
+            return None
+        fields = json.loads(row[3])
+        fields[0] = path
+        fields[7] = tuple(fields[7])
+        return batch.Summary(*fields)
+
+    def index(self, path):
+        '''Cached SiiIndex of a file, None if there is no current one or it did not parse'''
+        row = self._current(path)
+        if row == None or row[4] == None:
+            return None
+        return sii.SiiIndex.loads(row[4])
+
+    def store(self, scanned):
+        self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, NULL)', (
+            os.path.abspath(scanned.path), scanned.size, scanned.mtime_ns,
+            scanned.digest, json.dumps(scanned.summary), scanned.index))
+
+    def report(self, path):
+        '''str() of the parsed file, from the cache when current'''
+        row = self._current(path)
+        if row == None:
+            self.store(scan(path))
+        elif row[5] != None:
+            return row[5]
+        text = str(sii.from_file(path))
+        self._db.execute('UPDATE files SET report=? WHERE path=?',
+                         (text, os.path.abspath(path)))
+        return text
+
+    def close(self):
+        if self._db:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
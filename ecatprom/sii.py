@@ -1,21 +1,169 @@
 from .basictypes import *
+from . import crc
 from io import BytesIO
 import enum  # we keep the namespace to avoid collisions with our prom enum
+import mmap
+import os
+import struct
+from array import array
+from collections import namedtuple
+from types import MappingProxyType
 
 
-def from_file(fname):
-    f = open(fname, 'rb')
-    d = Sii()
-    d.take(Reader(f))
+def from_bytes(data, lazy=False, cache=None):
+    '''Parse an image held in memory (bytes, bytearray, mmap, memoryview...)'''
+    d = Sii(cache)
+    # bytes cant change under us, so the Sii can keep views of them
+    d.take(BufferReader(data), lazy, keep_views=isinstance(data, bytes))
     return d
 
 
-def to_file(s, fname):
-    f = open(fname, 'wb')
-    w = Writer(f)
-    s.put(w)
+def from_file(fname, lazy=False, cache=None, categories=None):
+    '''Parse an image file
+
+    categories - if given only these category types are read (see from_stream)
+    '''
+    with open(fname, 'rb') as f:
+        if categories != None:
+            return from_stream(f, categories, lazy, cache)[0]
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cant be mapped, let the parser complain about it
+            return from_bytes(f.read(), lazy, cache)
+    try:
+        return from_bytes(m, lazy, cache)
+    finally:
+        try:
+            m.close()
+        except BufferError:
+            pass  # a traceback is still holding a view, it gets unmapped with it
+
+
+def from_stream(f, categories=None, lazy=False, cache=None):
+    '''Parse an image from a seekable binary file, reading only what is needed
+
+    The image starts at the current position. The info block and the category
+    headers are read, seeking past payloads, then just the payloads of the
+    category types in categories (all by default). Others are only recorded as
+    skipped (see from_parts). The file is left just past the image. Returns
+    (Sii, bytes read)
+    '''
+    start = f.tell()
+    info = f.read(2*SiiIndex.INFO_WORDS)
+    index, nread = SiiIndex.scan(f, start)
+    payloads = {}
+    for e in index.entries:
+        if categories == None or e.category_type in categories:
+            f.seek(start + 2*e.word_offset)
+            payload = f.read(2*e.word_length)
+            nread += len(payload)
+            if len(payload) != 2*e.word_length:
+                raise OutOfBytesError()
+            payloads[e] = payload
+    end = index.entries[-1] if index.entries else IndexEntry(None, SiiIndex.INFO_WORDS, 0)
+    f.seek(start + 2*(end.word_offset + end.word_length) + 4)
+    return from_parts(info, index, payloads, lazy, cache), len(info) + nread
+
+
+def from_parts(info, index, payloads, lazy=False, cache=None):
+    '''Parse an image from its info block and some of its category payloads
+
+    index - SiiIndex of the whole image
+    payloads - {IndexEntry: bytes} of the categories that were read
+    The entries that werent read end up in the Sii's skipped list. Such a Sii
+    cant be written out whole, only patched back over its source (see
+    patch_file and Sii.regions)
+    '''
+    parts = [info]
+    skipped = []
+    for e in index.entries:
+        if e in payloads:
+            parts.append(SiiIndex._header.pack(e.category_type, e.word_length))
+            parts.append(payloads[e])
+        else:
+            skipped.append(e)
+    parts.append(SiiIndex._header.pack(CatType.END, 0))
+    s = from_bytes(b''.join(parts), lazy, cache)
+    if skipped:
+        s.source_index = index
+        s.skipped = skipped
+    return s
+
+
+def to_file(s, fname, fix_checksum=False):
+    # encode first, so a Sii that cant be put leaves the file alone
+    data = to_bytes(s, fix_checksum)
+    with open(fname, 'wb') as f:
+        f.write(data)
+
+
+def to_bytes(s, fix_checksum=False):
+    buffer = BytesIO()
+    w = Writer(buffer, chunk_size=1 << 16)
+    s.put(w, fix_checksum)
     w.flush()
-    f.close()
+    return buffer.getvalue()
+
+
+def word_patch(old, new):
+    '''[(word address, word value)] for every 16 bit word of new that differs from old
+
+    Words past the end of old are always included. Anything in old past the
+    end of new is left alone
+    '''
+    patch = []
+    block = 64  # compare in blocks first, most of an image wont have changed
+    for start in range(0, len(new), block):
+        if old[start:start + block] == new[start:start + block]:
+            continue
+        for i in range(start, min(start + block, len(new)), 2):
+            w = new[i:i + 2]
+            if old[i:i + 2] != w:
+                patch.append((i // 2, int.from_bytes(w, 'little')))
+    return patch
+
+
+def patch_runs(patch):
+    '''Merge a word patch into [(word address, bytes)] runs of consecutive words'''
+    runs = []
+    for addr, value in patch:
+        if runs and runs[-1][0] + len(runs[-1][1]) // 2 == addr:
+            runs[-1][1].extend(value.to_bytes(2, 'little'))
+        else:
+            runs.append((addr, bytearray(value.to_bytes(2, 'little'))))
+    return [(addr, bytes(data)) for addr, data in runs]
+
+
+def overlay(s, original, fix_checksum=False):
+    '''Image of s, with what s didnt read (see from_parts) taken from original'''
+    if not s.skipped:
+        return to_bytes(s, fix_checksum)
+    new = bytearray(original)
+    for addr, data in s.regions(fix_checksum):
+        new[2*addr:2*addr + len(data)] = data
+    return bytes(new)
+
+
+def patch_file(s, fname, fix_checksum=False, original=None):
+    '''Write only the words of a file that differ from the image of s
+
+    original - what the file is known to hold (say the bytes it was loaded
+               from), by default the file is read back to compare against
+    Categories s skipped are left as they are in the file
+    Returns the word patch that was applied
+    '''
+    with open(fname, 'r+b') as f:
+        if original == None:
+            original = f.read()
+        patch = word_patch(original, overlay(s, original, fix_checksum))
+        for addr, data in patch_runs(patch):
+            if hasattr(os, 'pwrite'):
+                os.pwrite(f.fileno(), data, 2*addr)
+            else:
+                f.seek(2*addr)
+                f.write(data)
+    return patch
 
 
 class CatType(enum.IntEnum):
@@ -78,15 +226,19 @@ def InfoStructure(): return Struct(
 )
 
 
+# enum option tables are shared by every field made from them, so read only
+PORT_DESCRIPTIONS = MappingProxyType({
+    0x00: "UNUSED",
+    0x01: "MII",
+    0x02: "RESERVED",
+    0x03: "EBUS",
+    0x04: "FAST HOT CONNECT",
+})
+
+
 def DescriptionOfPort(): return Enum(
     bits=4,
-    options={
-        0x00: "UNUSED",
-        0x01: "MII",
-        0x02: "RESERVED",
-        0x03: "EBUS",
-        0x04: "FAST HOT CONNECT",
-    }
+    options=PORT_DESCRIPTIONS,
 )
 
 
@@ -138,15 +290,18 @@ def CategoryGeneral(): return Struct(
 )
 
 
+FMMU_USAGES = MappingProxyType({
+    0x00: "UNUSED",
+    0x01: "OUTPUTS",
+    0x02: "INPUTS",
+    0x03: "SYNCM STATUS",
+    0xFF: "UNUSED",
+})
+
+
 def Fmmu(): return Enum(
     bits=8,
-    options={
-        0x00: "UNUSED",
-        0x01: "OUTPUTS",
-        0x02: "INPUTS",
-        0x03: "SYNCM STATUS",
-        0xFF: "UNUSED",
-    }
+    options=FMMU_USAGES,
 )
 
 
@@ -160,6 +315,15 @@ def FmmuEx(): return Struct(
 )
 
 
+SYNCM_TYPES = MappingProxyType({
+    0x00: "UNUSED",
+    0x01: "MBX_OUT",
+    0x02: "MBX_IN",
+    0x03: "PROCESS_DATA_OUT",
+    0x04: "PROCESS_DATA_IN",
+})
+
+
 def SyncM(): return Struct(
     physical_start_addr=Int(16),
     length=Int(16),
@@ -174,17 +338,21 @@ def SyncM(): return Struct(
     ),
     sync_manager_type=Enum(
         bits=8,
-        options={
-            0x00: "UNUSED",
-            0x01: "MBX_OUT",
-            0x02: "MBX_IN",
-            0x03: "PROCESS_DATA_OUT",
-            0x04: "PROCESS_DATA_IN",
-        }
+        options=SYNCM_TYPES,
     )
 )
 
 
+# layout follows the Su element of the ESI description
+def SyncUnit(): return Struct(
+    separate_su=Int(1),
+    separate_frame=Int(1),
+    depend_on_input_state=Int(1),
+    frame_repeat_support=Int(1),
+    reserved=NullBits(4),
+)
+
+
 def CategoryHeader(): return Struct(
     category_type=Int(16),
     len_in_words=Int(16),
@@ -204,178 +372,676 @@ def CategoryDc(): return Struct(
 )
 
 
-class Sii:
+def PdoHeader(): return Struct(
+    index=Int(16),
+    n_entries=Int(8),
+    sync_manager=Int(8),
+    dc_sync=Int(8),
+    name_idx=Int(8),
+    flags=Int(16),
+)
+
+
+def PdoEntry(): return Struct(
+    index=Int(16),
+    subindex=Int(8),
+    name_idx=Int(8),
+    data_type=Int(8),
+    bit_len=Int(8),
+    flags=Int(16),
+)
+
+
+UNASSIGNED_SM = 0xFF  # sync manager of a PDO that is not mapped
+
+
+class Pdo(Struct):
+    '''A PDO header followed by as many entries as it says it has'''
+
+    __slots__ = ()
 
     def __init__(self):
+        Struct.__init__(self, header=PdoHeader(), entries=Array(PdoEntry))
+
+    def take(self, reader):
+        header = codec_for(PdoHeader).take(reader)
+        n = header.n_entries.value
+        entries = Array(PdoEntry, count=n)
+        if n:
+            entries.take(reader)
+        self._members['header'] = header
+        self._members['entries'] = entries
+
+    def put(self, writer):
+        if self.header.n_entries.value != len(self.entries):
+            self.header.n_entries.value = len(self.entries)
+        codec_for(PdoHeader).put(self.header, writer)
+        self.entries.put(writer)
+
+
+PdoTable = namedtuple('PdoTable', [
+    'pdo',  # index of the PDO each entry belongs to
+    'sync_manager',
+    'index',
+    'subindex',
+    'name_idx',
+    'data_type',
+    'bit_len',
+])
+
+
+def pdo_table(pdos):
+    '''Column arrays with a row per PDO entry'''
+    t = PdoTable(array('H'), array('B'), array('H'), array('B'), array('B'),
+                 array('B'), array('B'))
+    for p in pdos:
+        h = p.header
+        for e in p.entries:
+            t.pdo.append(h.index.value)
+            t.sync_manager.append(h.sync_manager.value)
+            t.index.append(e.index.value)
+            t.subindex.append(e.subindex.value)
+            t.name_idx.append(e.name_idx.value)
+            t.data_type.append(e.data_type.value)
+            t.bit_len.append(e.bit_len.value)
+    return t
+
+
+def pdo_sm_bits(raw, bits=None):
+    '''{sync manager: mapped bits} straight from the bytes of a PDO category
+
+    Nothing gets decoded, the bit lengths of a PDO's entries are summed from a
+    strided slice. Pass bits to keep adding to an earlier result
+    '''
+    if bits == None:
+        bits = {}
+    pos = 0
+    while pos + 8 <= len(raw):
+        n = raw[pos + 2]
+        sm = raw[pos + 3]
+        end = pos + 8 + 8*n
+        if end > len(raw):
+            raise OutOfBytesError()
+        if sm != UNASSIGNED_SM:
+            bits[sm] = bits.get(sm, 0) + sum(raw[pos + 13:end:8])
+        pos = end
+    return bits
+
+
+def _take_struct(factory, name):
+    def take(reader):
+        item = codec_for(factory).take(reader)
+        if reader.remaining():
+            raise RuntimeError('Data for {} Category is malformed'.format(name))
+        return item
+    return take
+
+
+def _take_array(item_type, name, **kwargs):
+    def take(reader):
+        item = Array(item_type=item_type, **kwargs)
+        item.take(reader)
+        if reader.remaining() > 1:  # padding may be added
+            raise RuntimeError('Data for {} Category is malformed'.format(name))
+        return item
+    return take
+
+
+# category type -> (Sii attribute, decoder, factory for the codec used to write it)
+# in the order categories get written out. Without a decoder a category stays
+# in Sii.unknown as raw bytes
+CATEGORIES = {
+    CatType.STRINGS: ('strings', _take_array(String, 'String', length_prefixed=True), None),
+    CatType.General: ('general', _take_struct(CategoryGeneral, 'General'), CategoryGeneral),
+    CatType.FMMU: ('fmmu', _take_array(Fmmu, 'FMMU'), None),
+    CatType.SyncM: ('syncm', _take_array(SyncM, 'SyncM'), None),
+    CatType.FMMUX: ('fmmux', _take_array(FmmuEx, 'FMMU EX'), None),
+    CatType.SyncUnit: ('sync_unit', _take_array(SyncUnit, 'SyncUnit'), None),
+    CatType.TXPDO: ('txpdo', _take_array(Pdo, 'TXPDO'), None),
+    CatType.RXPDO: ('rxpdo', _take_array(Pdo, 'RXPDO'), None),
+    CatType.DC: ('dc', _take_array(CategoryDc, 'DC'), None),
+}
+
+# fixed size record each array category is made of
+RECORDS = {
+    CatType.FMMU: Fmmu,
+    CatType.SyncM: SyncM,
+    CatType.FMMUX: FmmuEx,
+    CatType.SyncUnit: SyncUnit,
+    CatType.DC: CategoryDc,
+}
+
+# (Sii attribute, path) of every field indexing the strings category, a *
+# stands for each member of an array. General fields go first to keep the
+# usual numbering after compacting
+STRING_REFS = (
+    ('general', 'name_idx'),
+    ('general', 'group_idx'),
+    ('general', 'order_idx'),
+    ('general', 'img_idx'),
+    ('general', 'group_idx_1'),
+    ('dc', '*.name_idx'),
+    ('dc', '*.desc_idx'),
+    ('txpdo', '*.header.name_idx'),
+    ('txpdo', '*.entries.*.name_idx'),
+    ('rxpdo', '*.header.name_idx'),
+    ('rxpdo', '*.entries.*.name_idx'),
+)
+
+# categories that can show up more than once, their payloads are joined and
+# decoded as one
+REPEATABLE = (CatType.TXPDO, CatType.RXPDO)
+
+
+def _category(cat_id):
+    '''Category attribute for Sii which decodes pending raw data on first access'''
+    name, decode, _ = CATEGORIES[cat_id]
+
+    def fget(self):
+        if name in self._pending:
+            payloads = self._pending[name]
+            self._decode(cat_id, payloads, payloads)
+            # only now, a payload that fails to decode is still written back
+            del self._pending[name]
+        return self._cats[name]
+
+    def fset(self, v):
+        self._pending.pop(name, None)
+        self._cats[name] = v
+    return property(fget, fset)
+
+
+IndexEntry = namedtuple('IndexEntry', 'category_type word_offset word_length')
+
+
+class SiiIndex:
+    '''Where each category of an image lives, found by walking only the headers
+
+    entries holds an IndexEntry per category, the offset is of the payload
+    (just after the header) in words from the start of the image
+    '''
+
+    INFO_WORDS = 0x40  # categories start right after the info block
+    _header = struct.Struct('<HH')
+    _entry = struct.Struct('<HII')
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+
+    @classmethod
+    def build(cls, data):
+        '''Index an image held in memory'''
+        view = memoryview(data)
+        entries = []
+        word = cls.INFO_WORDS
+        while True:
+            if 2*word + 4 > len(view):
+                raise OutOfBytesError()
+            cat_id, nwords = cls._header.unpack_from(view, 2*word)
+            if cat_id == CatType.END:
+                break
+            word += 2
+            if 2*(word + nwords) > len(view):
+                raise OutOfBytesError()
+            entries.append(IndexEntry(cat_id, word, nwords))
+            word += nwords
+        return cls(entries)
+
+    @classmethod
+    def scan(cls, f, start=0):
+        '''Index an image in a seekable binary file, reading just the category headers
+
+        start - file position of the image. Returns (index, bytes read)
+        '''
+        entries = []
+        word = cls.INFO_WORDS
+        nread = 0
+        while True:
+            f.seek(start + 2*word)
+            header = f.read(4)
+            nread += len(header)
+            if len(header) != 4:
+                raise OutOfBytesError()
+            cat_id, nwords = cls._header.unpack(header)
+            if cat_id == CatType.END:
+                break
+            word += 2
+            entries.append(IndexEntry(cat_id, word, nwords))
+            word += nwords
+        return cls(entries), nread
+
+    def find(self, cat_id):
+        '''First entry of a category type, None if there is none'''
+        for e in self.entries:
+            if e.category_type == cat_id:
+                return e
+        return None
+
+    def find_all(self, cat_id):
+        return [e for e in self.entries if e.category_type == cat_id]
+
+    @staticmethod
+    def view(data, entry):
+        '''Payload of an entry as a view into the image'''
+        return memoryview(data)[2*entry.word_offset:2*(entry.word_offset + entry.word_length)]
+
+    def take(self, data, cat_id):
+        '''Decode a single category straight out of an image
+
+        Unknown categories come back as raw bytes, missing ones as None
+        '''
+        e = self.find(cat_id)
+        if e == None:
+            return None
+        _, decode, _ = CATEGORIES.get(cat_id, (None, None, None))
+        if decode == None:
+            return bytes(self.view(data, e))
+        if cat_id in REPEATABLE:
+            return decode(BufferReader(b''.join(self.view(data, e) for e in self.find_all(cat_id))))
+        return decode(BufferReader(self.view(data, e)))
+
+    def process_data_bits(self, data):
+        '''(output bits, input bits) mapped by the PDOs of an image, without decoding'''
+        totals = []
+        for cat_id in (CatType.RXPDO, CatType.TXPDO):
+            bits = {}
+            for e in self.find_all(cat_id):
+                pdo_sm_bits(self.view(data, e), bits)
+            totals.append(sum(bits.values()))
+        return tuple(totals)
+
+    def columns(self, data, cat_id, paths=None):
+        '''{field path: array} over the records of a category, without decoding
+
+        See RECORDS for the categories this works on
+        '''
+        codec = codec_for(RECORDS[cat_id])
+        e = self.find(cat_id)
+        return codec.columns(self.view(data, e) if e else b'', paths)
+
+    def dumps(self):
+        '''Serialize the index so it can be stored next to the image'''
+        return len(self.entries).to_bytes(4, 'little') + \
+            b''.join(self._entry.pack(*e) for e in self.entries)
+
+    @classmethod
+    def loads(cls, data):
+        n = int.from_bytes(data[:4], 'little')
+        if len(data) != 4 + n*cls._entry.size:
+            raise ValueError('Index data is truncated')
+        return cls(IndexEntry(*e) for e in cls._entry.iter_unpack(data[4:]))
+
+    def __eq__(self, other):
+        return isinstance(other, SiiIndex) and self.entries == other.entries
+
+    def __str__(self):
+        return '\n'.join('0x{:04X} @ word 0x{:X}, {} words'.format(*e) for e in self.entries)
+
+
+def columns_many(images, cat_id, paths=None):
+    '''{field path: array} over the records of a category in many images
+
+    The payloads of every image are joined and unpacked in one pass. The extra
+    'image' column gives the position in images each row came from
+    '''
+    codec = codec_for(RECORDS[cat_id])
+    payloads = []
+    owner = array('L')
+    for i, data in enumerate(images):
+        e = SiiIndex.build(data).find(cat_id)
+        if e == None:
+            continue
+        # drop padding so records stay back to back
+        view = SiiIndex.view(data, e)
+        view = view[:len(view) - len(view) % codec.size]
+        payloads.append(view)
+        owner.extend([i] * (len(view) // codec.size))
+    cols = codec.columns(b''.join(payloads), paths)
+    cols['image'] = owner
+    return cols
+
+
+class Sii:
+
+    strings = _category(CatType.STRINGS)
+    general = _category(CatType.General)
+    fmmu = _category(CatType.FMMU)
+    syncm = _category(CatType.SyncM)
+    fmmux = _category(CatType.FMMUX)
+    sync_unit = _category(CatType.SyncUnit)
+    txpdo = _category(CatType.TXPDO)
+    rxpdo = _category(CatType.RXPDO)
+    dc = _category(CatType.DC)
+
+    def __init__(self, cache=None):
+        '''
+        cache - a cache.CategoryCache so categories seen in other images are
+                copied rather than decoded again
+        '''
         self.info = None
-        self.strings = None
-        self.general = None
-        self.fmmu = None
-        self.syncm = None
-        self.fmmux = None
-        self.sync_unit = None
-        self.txpdo = None
-        self.rxpdo = None
-        self.dc = None
+        self._cache = cache
+        # decoded categories by attribute name
+        self._cats = {name: None for name, _, _ in CATEGORIES.values()}
+        # payloads of categories not decoded yet when taken lazily, as a list
+        # since some categories may be repeated
+        self._pending = {}
+        # (item, payloads it was taken from) so unchanged items can be copied
+        # out, for info it is (item, raw bytes)
+        self._orig = {}
+        # (strings array, its length, {string: index}) see _string_lookup
+        self._string_index = None
         # we track these so we can reserialize as is
         self.unknown = []  # (category type, bytes)
+        # IndexEntry of each category a filtered read left out, and the
+        # SiiIndex of the image it came from (see from_parts)
+        self.skipped = []
+        self.source_index = None
 
     @property
     def general_name(self):
         '''Helper to get the name string'''
-        if self.general and self.strings:
-            if self.general.name_idx.value != 0:
-                return self.strings[self.general.name_idx.value - 1].value
+        return self._get_string(self.general, 'name_idx')
 
     @general_name.setter
     def general_name(self, s):
         '''Helper to set the name string'''
-        if self.general == None:
-            raise RuntimeError('Need a general section to add name string')
-        if self.strings == None:
-            self.strings = Array(String, length_prefixed=True)
-        self.strings.append(String(s))
-        self.general.name_idx.value = len(self.strings)
-        self.compact_strings()
+        self._set_general_string('name_idx', s, 'name')
 
     @property
     def general_group(self):
         '''Helper to get the group string'''
-        if self.general and self.strings:
-            if self.general.group_idx.value != 0:
-                return self.strings[self.general.group_idx.value - 1].value
+        return self._get_string(self.general, 'group_idx')
 
     @general_group.setter
     def general_group(self, s):
         '''Helper to set the group string'''
-        if self.general == None:
-            raise RuntimeError('Need a general section to add group string')
-        if self.strings == None:
-            self.strings = Array(String, length_prefixed=True)
-        self.strings.append(String(s))
-        self.general.group_idx.value = len(self.strings)
-        self.compact_strings()
+        self._set_general_string('group_idx', s, 'group')
 
     @property
     def general_order(self):
         '''Helper to get the order string'''
-        if self.general and self.strings:
-            if self.general.order_idx.value != 0:
-                return self.strings[self.general.order_idx.value - 1].value
+        return self._get_string(self.general, 'order_idx')
 
     @general_order.setter
     def general_order(self, s):
         '''Helper to set the order string'''
+        self._set_general_string('order_idx', s, 'order')
+
+    def _get_string(self, item, field):
+        if item and self.strings:
+            idx = getattr(item, field).value
+            if idx != 0:
+                return self.strings[idx - 1].value
+
+    def _set_general_string(self, field, s, what):
         if self.general == None:
-            raise RuntimeError('Need a general section to add order string')
+            raise RuntimeError('Need a general section to add {} string'.format(what))
+        self.set_string(getattr(self.general, field), s)
+
+    def string_refs(self):
+        '''Yield every Int field holding an index into the strings category'''
+        for name, path in STRING_REFS:
+            item = getattr(self, name)
+            if item == None:
+                continue
+            items = [item]
+            for k in path.split('.'):
+                if k == '*':
+                    items = [m for i in items for m in i]
+                else:
+                    items = [getattr(i, k) for i in items]
+            yield from items
+
+    def _string_lookup(self):
+        '''{string: index} of the strings category, rebuilt if strings were replaced or resized
+
+        Editing String values in place is not noticed, call compact_strings after
+        '''
+        strings = self.strings
+        n = len(strings) if strings != None else 0
+        cache = self._string_index
+        if cache == None or cache[0] is not strings or cache[1] != n:
+            lookup = {}
+            for i in range(n):
+                lookup.setdefault(strings[i].value, i + 1)
+            cache = self._string_index = (strings, n, lookup)
+        return cache[2]
+
+    def intern_string(self, s):
+        '''Index of a string in the strings category, adding it if its not there'''
+        lookup = self._string_lookup()
+        if s in lookup:
+            return lookup[s]
         if self.strings == None:
             self.strings = Array(String, length_prefixed=True)
         self.strings.append(String(s))
-        self.general.order_idx.value = len(self.strings)
-        self.compact_strings()
+        lookup[s] = len(self.strings)
+        self._string_index = (self.strings, len(self.strings), lookup)
+        return lookup[s]
+
+    def set_string(self, ref, s):
+        '''Point a string index field at s, dropping the old string if nothing else uses it'''
+        old = ref.value
+        new = self.intern_string(s)
+        if new == old:
+            return
+        ref.value = new
+        if old and not any(r.value == old for r in self.string_refs()):
+            self.compact_strings()
+
+    def string_refcounts(self):
+        '''Number of references to each string, index 0 counts unset fields'''
+        counts = [0] * ((len(self.strings) if self.strings != None else 0) + 1)
+        for r in self.string_refs():
+            if r.value < len(counts):
+                counts[r.value] += 1
+        return counts
 
     def compact_strings(self):
-        '''Remove unused strings'''
-        if self.general == None:
+        '''Remove unused and duplicate strings, remapping every reference in one pass'''
+        old = self.strings if self.strings != None else ()
+        new = Array(String, length_prefixed=True)
+        lookup = {}
+        for ref in self.string_refs():
+            idx = ref.value
+            if not idx:
+                continue
+            if idx > len(old):
+                ref.value = 0
+                continue
+            s = old[idx - 1].value
+            if s not in lookup:
+                new.append(String(s))
+                lookup[s] = len(new)
+            if idx != lookup[s]:
+                ref.value = lookup[s]
+        if self.general == None and not len(new):
             self.strings = None
-            return
-        g = self.general
-        a = []
-        if g.name_idx.value:
-            if g.name_idx.value > len(self.strings):
-                g.name_idx.value = 0
-            else:
-                s = self.strings[g.name_idx.value - 1].value
-                if s not in a:
-                    a.append(s)
-                g.name_idx.value = len(a)
-        if g.group_idx.value:
-            if g.group_idx.value > len(self.strings):
-                g.group_idx.value = 0
-            else:
-                s = self.strings[g.group_idx.value - 1].value
-                if s not in a:
-                    a.append(s)
-                g.group_idx.value = len(a)
-        if g.order_idx.value:
-            if g.order_idx.value > len(self.strings):
-                g.order_idx.value = 0
-            else:
-                s = self.strings[g.order_idx.value - 1].value
-                if s not in a:
-                    a.append(s)
-                g.order_idx.value = len(a)
-        if g.img_idx.value:
-            if g.img_idx.value > len(self.strings):
-                g.img_idx.value = 0
+        else:
+            self.strings = new
+        self._string_index = (self.strings, len(new), lookup)
+
+    def process_data_bits(self):
+        '''(output bits, input bits) mapped by the RXPDOs and TXPDOs'''
+        totals = []
+        for name in ('rxpdo', 'txpdo'):
+            if name in self._pending:
+                bits = {}
+                for raw in self._pending[name]:
+                    pdo_sm_bits(raw, bits)
+                totals.append(sum(bits.values()))
             else:
-                s = self.strings[g.img_idx.value - 1].value
-                if s not in a:
-                    a.append(s)
-                g.img_idx.value = len(a)
-        self.strings = Array(String, length_prefixed=True)
-        for s in a:
-            ss = String()
-            ss.value = s
-            self.strings.append(ss)
-
-    def put(self, w):
+                pdos = getattr(self, name) or ()
+                totals.append(sum(e.bit_len.value for p in pdos
+                                  if p.header.sync_manager.value != UNASSIGNED_SM
+                                  for e in p.entries))
+        return tuple(totals)
+
+    def _info_bytes(self):
+        '''Encoded info section, reserved bytes are kept from the image it was taken from'''
+        item, raw = self._orig.get('info', (None, None))
+        if item is not self.info:
+            raw = None
+        elif not item.dirty:
+            return raw
+        codec = codec_for(InfoStructure)
+        buffer = BytesIO()
+        codec.put(self.info, Writer(buffer))
+        data = bytearray(buffer.getvalue())
+        if raw != None:
+            for offset, n in codec.gaps:
+                data[offset:offset + n] = raw[offset:offset + n]
+        return bytes(data)
+
+    def config_checksum(self):
+        '''CRC the config area of the info section should have'''
+        return crc.config_crc(self._info_bytes())
+
+    def checksum_ok(self):
+        return self.info.checksum.value == self.config_checksum()
+
+    def fix_checksum(self):
+        '''Store the correct CRC for the current config data'''
+        self.info.checksum.value = self.config_checksum()
+
+    def put(self, w, fix_checksum=False):
+        if self.skipped:
+            raise RuntimeError('Only some categories were read, patch the source instead')
+        self._put(w, fix_checksum)
+
+    def regions(self, fix_checksum=False):
+        '''[(word address, bytes)] of everything that was read, where it sits in the source
+
+        For a whole image thats just [(0, the image)]. Otherwise the info block
+        and each category read are encoded in place, which fails with a
+        ValueError if a category was added, removed or changed size
+        '''
+        buffer = BytesIO()
+        w = Writer(buffer, chunk_size=1 << 16)
+        self._put(w, fix_checksum)
+        w.flush()
+        new = buffer.getvalue()
+        if not self.skipped:
+            return [(0, new)]
+        skipped = set(self.skipped)
+        read = {}  # category type -> entries read, in source order
+        for e in self.source_index.entries:
+            if e not in skipped:
+                read.setdefault(e.category_type, []).append(e)
+        out = [(0, new[:2*SiiIndex.INFO_WORDS])]
+        for e in SiiIndex.build(new).entries:
+            src = read.get(e.category_type)
+            if not src or src[0].word_length != e.word_length:
+                raise ValueError('Category {} no longer fits where it was read from, '
+                                 'read the whole image to write it'.format(e.category_type))
+            out.append((src.pop(0).word_offset,
+                        new[2*e.word_offset:2*(e.word_offset + e.word_length)]))
+        for src in read.values():
+            if src:
+                raise ValueError('Category {} was removed, read the whole image to '
+                                 'write it'.format(src[0].category_type))
+        return out
+
+    def _put(self, w, fix_checksum):
         if not self.info:
             raise RuntimeError('Requires an info section to write')
-        self.info.put(w)
+        if fix_checksum:
+            self.fix_checksum()
+        w.write_bytes(self._info_bytes())
 
         header = CategoryHeader()
 
-        def putcat(category_type, item):
+        def putraw(category_type, raw_data):
+            # setup the header
+            header.category_type.value = category_type
+            header.len_in_words.value = len(raw_data)//2
+            # insert header
+            header.put(w)
+            # insert data
+            w.write_bytes(raw_data)
+
+        def putcat(category_type, item, factory=None):
             # handle non-existent categories
             if item == None:
                 return
             # create the buffer
             buffer = BytesIO()
-            lw = Writer(buffer)
+            lw = Writer(buffer, chunk_size=1 << 16)
             # put the item in it
-            item.put(lw)
+            if factory:
+                codec_for(factory).put(item, lw)
+            else:
+                item.put(lw)
             lw.flush()
             # check for required padding
             if len(buffer.getvalue()) & 1:
                 buffer.write(b'\x00')  # pad to even number of bytes
             # get the padded data
-            raw_data = buffer.getvalue()
-            # setup the header
-            header.category_type.value = category_type
-            header.len_in_words.value = len(raw_data)//2
-            # insert header
-            header.put(w)
-            # insert data
-            w.write_bytes(raw_data)
+            putraw(category_type, buffer.getvalue())
 
-        putcat(CatType.STRINGS, self.strings)
-        putcat(CatType.General, self.general)
-        putcat(CatType.FMMU, self.fmmu)
-        putcat(CatType.SyncM, self.syncm)
-        putcat(CatType.FMMUX, self.fmmux)
-        putcat(CatType.SyncUnit, self.sync_unit)
-        putcat(CatType.TXPDO, self.txpdo)
-        putcat(CatType.RXPDO, self.rxpdo)
-        putcat(CatType.DC, self.dc)
+        for cat_id, (name, _, factory) in CATEGORIES.items():
+            if name in self._pending:
+                # never looked at so it cant have changed
+                for raw in self._pending[name]:
+                    putraw(cat_id, raw)
+            elif self._unchanged(name):
+                for raw in self._orig[name][1]:
+                    putraw(cat_id, raw)
+            else:
+                putcat(cat_id, self._cats[name], factory)
         for cat, data in self.unknown:
-            header.category_type.value = cat
-            header.len_in_words.value = len(data)//2
-            header.put(w)
-            w.write_bytes(data)
+            putraw(cat, data)
 
         # insert end marker
         header.category_type.value = CatType.END
         header.len_in_words.value = 0xFFFF
         header.put(w)
 
-    def take(self, reader):
-        self.info = InfoStructure()
-        self.info.take(reader)
-        self.take_categories(reader)
+    def take(self, reader, lazy=False, keep_views=False):
+        '''Parse an image
+
+        With lazy set categories are only decoded on first access to their
+        attribute, until then their raw bytes are kept (and written back as is)
 
-    def take_categories(self, reader):
+        Decoding always runs on views of the reader's buffer. What has to be
+        kept for writing unchanged parts back out is copied, unless keep_views
+        is set, in which case views are kept instead. Only do that when the
+        buffer wont change or go away (from_bytes does it for bytes), a kept
+        view holds on to the whole buffer
+        '''
+        codec = codec_for(InfoStructure)
+        view = reader.read_view(codec.size)
+        self.info = codec.take(BufferReader(view))
+        self._orig['info'] = (self.info, view if keep_views else bytes(view))
+        self.take_categories(reader, lazy, keep_views)
+
+    def raw_payloads(self, name):
+        '''Payloads a category was taken from, None if it was replaced or modified since'''
+        if name in self._pending:
+            return self._pending[name]
+        if self._unchanged(name):
+            return self._orig[name][1]
+        return None
+
+    def _unchanged(self, name):
+        '''True if an item is the one we took and it has not been modified'''
+        item, _ = self._orig.get(name, (None, None))
+        return item != None and item is getattr(self, name) and not item.dirty
+
+    def _decode(self, cat_id, payloads, keep):
+        '''Decode a category from its payloads, keep is what to copy out unchanged later'''
+        name, decode, _ = CATEGORIES[cat_id]
+        data = payloads[0] if len(payloads) == 1 else b''.join(payloads)
+        if self._cache:
+            item = self._cache.decode(cat_id, data)
+        else:
+            item = decode(BufferReader(data))
+        self._cats[name] = item
+        self._orig[name] = (item, keep)
+
+    def take_categories(self, reader, lazy=False, keep_views=False):
         header = CategoryHeader()
+        payloads = {}
         while True:
             # read the header
             header.take(reader)
@@ -384,47 +1050,27 @@ class Sii:
             # exit the loop if we are done
             if cat_id == CatType.END:
                 break
-            # move the data into a separate buffer so misbehaving defintions can be detected
-            buffer = BytesIO(reader.read_bytes(nbytes))
-            # elif header.cat_type == CatType.STRINGS:
-            if cat_id == CatType.General:
-                self.general = CategoryGeneral()
-                self.general.take(Reader(buffer))
-                if buffer.read():
-                    raise RuntimeError(
-                        'Data for General Category is malformed')
-            elif cat_id == CatType.DC:
-                self.dc = CategoryDc()
-                self.dc.take(Reader(buffer))
-                if buffer.read():
-                    raise RuntimeError('Data for DC Category is malformed')
-            elif cat_id == CatType.STRINGS:
-                self.strings = Array(item_type=String, length_prefixed=True)
-                self.strings.take(Reader(buffer))
-                if len(buffer.read()) > 1:  # padding may be added
-                    raise RuntimeError('Data for String Category is malformed')
-            elif cat_id == CatType.FMMU:
-                self.fmmu = Array(item_type=Fmmu)
-                self.fmmu.take(Reader(buffer))
-                if len(buffer.read()) > 1:  # padding may be added
-                    raise RuntimeError('Data for FMMU Category is malformed')
-            elif cat_id == CatType.FMMUX:
-                self.fmmux = Array(item_type=FmmuEx)
-                self.fmmux.take(Reader(buffer))
-                if len(buffer.read()) > 1:  # padding may be added
-                    raise RuntimeError(
-                        'Data for FMMU EX Category is malformed')
-            elif cat_id == CatType.SyncM:
-                self.syncm = Array(item_type=SyncM)
-                self.syncm.take(Reader(buffer))
-                if len(buffer.read()) > 1:  # padding may be added
-                    raise RuntimeError('Data for SyncM Category is malformed')
+            # give each category its own reader so misbehaving defintions can be detected
+            sub = reader.sub_reader(nbytes)
+            name, decode, _ = CATEGORIES.get(cat_id, (None, None, None))
+            if decode == None:
+                self.unknown.append((cat_id, sub.read_bytes(nbytes)))
+            elif cat_id in REPEATABLE:
+                payloads.setdefault(cat_id, []).append(sub.read_view(nbytes))
+            else:
+                payloads[cat_id] = [sub.read_view(nbytes)]
+        for cat_id, views in payloads.items():
+            name = CATEGORIES[cat_id][0]
+            keep = views if keep_views else [bytes(v) for v in views]
+            if lazy:
+                self._cats[name] = None
+                self._pending[name] = keep
             else:
-                self.unknown.append((cat_id, buffer.read()))
+                self._decode(cat_id, views, keep)
 
     def __str__(self):
         lines = []
-        for member in self.__dict__.keys():
+        for member in ['info'] + [name for name, _, _ in CATEGORIES.values()]:
             m = getattr(self, member)
             if isinstance(m, Item):
                 lines.append('== {} =='.format(member.upper()))
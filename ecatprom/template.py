@@ -0,0 +1,90 @@
+'''Stamp per unit values (serial number, alias, ...) into copies of a golden image
+
+The golden image is parsed once to find where each field lives. After that a
+unit is just a copy of the bytes, a struct.pack_into per field and, for fields
+inside the config area, an incremental update of the checksum.
+'''
+import struct
+
+from . import crc
+from . import sii
+from .basictypes import codec_for
+
+# info fields stamped by default, dotted paths as in InfoStructure
+FIELDS = ('id.serial_number', 'configured_alias')
+
+_formats = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+_checksum = struct.Struct('<H')
+
+
+class Template:
+
+    def __init__(self, image, fields=FIELDS):
+        self.image = bytes(image)
+        sii.from_bytes(self.image, lazy=True)  # just to be sure it parses
+        codec = codec_for(sii.InfoStructure)
+        self.fields = tuple(fields)
+        self._slots = []  # (offset, byte count, struct, inside config area)
+        base = crc.config_crc(self.image)
+        for f in self.fields:
+            offset, n = codec.byte_range(f)
+            if n not in _formats:
+                raise ValueError('Cant stamp {} byte field {}'.format(n, f))
+            self._slots.append((offset, n, struct.Struct('<' + _formats[n]),
+                                offset < crc.CONFIG_BYTES))
+            # the crc with this field zeroed, so units only add their own bytes
+            base ^= crc.config_crc_delta(offset, self.image[offset:offset + n], bytes(n))
+        self._base_crc = base
+        self._fix_crc = any(s[3] for s in self._slots)
+
+    def __len__(self):
+        return len(self.image)
+
+    def golden_values(self):
+        '''Values of our fields in the golden image'''
+        return tuple(st.unpack_from(self.image, offset)[0]
+                     for offset, _, st, _ in self._slots)
+
+    def render_into(self, buf, pos, values):
+        '''Stamp values (one per field) into a copy of the image at buf[pos:]'''
+        if len(values) != len(self._slots):
+            raise ValueError('Need {} values, one per field'.format(len(self._slots)))
+        c = self._base_crc
+        for (offset, n, st, in_config), v in zip(self._slots, values):
+            st.pack_into(buf, pos + offset, v)
+            if in_config:
+                at = pos + offset
+                c ^= crc.config_crc_delta(offset, bytes(n), buf[at:at + n])
+        if self._fix_crc:
+            _checksum.pack_into(buf, pos + crc.CHECKSUM_OFFSET, c)
+
+    def render(self, values):
+        '''New image with values stamped in'''
+        buf = bytearray(self.image)
+        self.render_into(buf, 0, values)
+        return buf
+
+    def render_many(self, rows, batch=1024):
+        '''Yield bytearrays holding up to batch back to back images, one per row of values'''
+        size = len(self.image)
+        rows = iter(rows)
+        while True:
+            chunk = []
+            for values in rows:
+                chunk.append(values)
+                if len(chunk) == batch:
+                    break
+            if not chunk:
+                return
+            buf = bytearray(self.image * len(chunk))
+            for i, values in enumerate(chunk):
+                self.render_into(buf, i * size, values)
+            yield buf
+
+    def write_many(self, rows, fp, batch=1024):
+        '''Write images for all rows back to back to a binary file, returns how many'''
+        n = 0
+        for buf in self.render_many(rows, batch):
+            fp.write(buf)
+            n += len(buf) // len(self.image)
+        return n
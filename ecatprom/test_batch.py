@@ -0,0 +1,22 @@
+from ecatprom import batch
+from ecatprom.sii import CatType
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def test_parse_many(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'a.bin').write_bytes(to_bytes(make_sii()))
+    (tmp_path / 'sub' / 'b.bin').write_bytes(to_bytes(make_sii()))
+    (tmp_path / 'sub' / 'bad.bin').write_bytes(b'\x00' * 10)
+    (tmp_path / 'notes.txt').write_text('not an image')
+    paths = list(batch.find_images([str(tmp_path)]))
+    assert [p[len(str(tmp_path)):] for p in paths] == [
+        '/a.bin', '/sub/b.bin', '/sub/bad.bin']
+    for workers in (1, 2):
+        a, b, bad = batch.parse_many(paths, workers=workers, chunksize=1)
+        assert a.error == None
+        assert a.name == 'EK1100'
+        assert a.serial_number == 42
+        assert a.categories[:2] == (CatType.STRINGS, CatType.General)
+        assert b._replace(path=None) == a._replace(path=None)
+        assert bad.error.startswith('OutOfBytesError')
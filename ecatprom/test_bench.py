@@ -0,0 +1,28 @@
+from ecatprom import bench, crc, sii
+from ecatprom.sii import CatType
+
+
+def test_synthetic_image():
+    data = bench.synthetic_image(strings=5, syncm=3, fmmu=2, pdos=2, unknown=1)
+    s = sii.from_bytes(data)
+    assert len(s.strings) == 5
+    assert len(s.syncm) == 3
+    assert len(s.fmmu) == 2
+    assert s.checksum_ok()
+    cats = [e.category_type for e in sii.SiiIndex.build(data).entries]
+    assert cats.count(CatType.TXPDO) == cats.count(CatType.RXPDO) == 2
+    assert bench.synthetic_image(seed=3) == bench.synthetic_image(seed=3)
+
+
+def test_run():
+    results = bench.run(['small'], ['take', 'put'], min_time=0, repeat=1)
+    assert [r['benchmark'] for r in results] == ['take', 'put']
+    assert all(r['images_per_sec'] > 0 for r in results)
+
+
+def test_put_unchanged_stays_unchanged():
+    cases = bench.benchmarks(bench.synthetic_image())
+    put_unchanged = cases['put_unchanged'][0]
+    parsed = [c.cell_contents for c in put_unchanged.__closure__
+              if isinstance(c.cell_contents, sii.Sii)]
+    assert parsed and not parsed[0].info.dirty
@@ -0,0 +1,53 @@
+from ecatprom import export, sii
+from ecatprom.cache import CategoryCache
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def images():
+    out = []
+    for serial in (1, 2, 3):
+        s = make_sii()
+        s.info.id.serial_number.value = serial
+        out.append(to_bytes(s))
+    return out
+
+
+def test_shared_decode():
+    cache = CategoryCache(maxsize=8)
+    parsed = [sii.from_bytes(d, lazy=True, cache=cache) for d in images()]
+    assert len({id(p.strings) for p in parsed}) == 3
+    assert parsed[1].info.id.serial_number.value == 2
+    assert cache.misses == 1 and cache.hits == 2
+    assert parsed[2].general_name == 'EK1100'
+    # decoding these is cheaper than copying them, so they are never cached
+    assert len({id(p.general) for p in parsed}) == 3
+    assert cache.misses == 1 and len(cache._items) == 1
+
+
+def test_cached_items_are_not_shared():
+    cache = CategoryCache()
+    data = images()
+    a, b = [sii.from_bytes(d, cache=cache) for d in data[:2]]
+    assert a.strings is not b.strings and cache.hits
+    a.strings[0].value = 'EK1101'
+    a.syncm[0].physical_start_addr.value = 0x2000
+    assert b.syncm[0].physical_start_addr.value == 0x1000
+    assert b.general_name == 'EK1100' and not b.syncm.dirty
+    assert to_bytes(b) == data[1]
+    c = sii.from_bytes(data[2], cache=cache)
+    assert c.syncm[0].physical_start_addr.value == 0x1000
+    assert str(c) == str(sii.from_bytes(data[2]))
+
+
+def test_records(tmp_path):
+    db = str(tmp_path / 'cache.sqlite')
+    data = images()
+    plain = [list(export.iter_fields(sii.from_bytes(d))) for d in data]
+    with CategoryCache(path=db) as cache:
+        cached = [list(export.iter_fields(sii.from_bytes(d, lazy=True), cache)) for d in data]
+        assert len(cache._items) == 4  # strings, general, fmmu, syncm
+    assert cached == plain
+    with CategoryCache(path=db) as cache:
+        again = list(export.iter_fields(sii.from_bytes(data[0], lazy=True), cache))
+        assert not cache._items  # everything came off disk
+    assert again == plain[0]
@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from ecatprom import crc
+
+
+def crc8_bitwise(data):
+    c = 0xFF
+    for b in data:
+        c ^= b
+        for _ in range(8):
+            c = ((c << 1) ^ 0x07) & 0xFF if c & 0x80 else (c << 1) & 0xFF
+    return c
+
+
+def test_crc8():
+    rng = random.Random(7)
+    images = [bytes(rng.randrange(256) for _ in range(16)) for _ in range(50)]
+    expected = bytes(crc8_bitwise(i[:14]) for i in images)
+    assert bytes(crc.config_crc(i) for i in images) == expected
+    assert crc.config_crc_many(images) == expected
+    assert crc.config_crc_many([]) == b''
+
+
+def test_check_images():
+    good = bytes(14)
+    good += crc.config_crc(good).to_bytes(2, 'little')
+    bad = b'\x01' + good[1:]
+    assert list(crc.check_images([good, bad, good])) == [
+        (1, good[14], crc.config_crc(bad))]
+    # two short images must not pass as one whole one
+    with pytest.raises(ValueError):
+        list(crc.check_images([b'\x01' * 7, b'\x02' * 7]))
+
+
+def test_config_crc_delta():
+    image = bytes(range(20, 40))
+    for offset, new in ((8, b'\x34\x12'), (12, b'\xff\xff\xff'), (20, b'\x01')):
+        patched = bytearray(image)
+        patched[offset:offset + len(new)] = new
+        delta = crc.config_crc_delta(offset, image[offset:offset + len(new)], new)
+        assert crc.config_crc(image) ^ delta == crc.config_crc(patched)
@@ -0,0 +1,41 @@
+from ecatprom import sii
+from ecatprom.diff import diff, diff_many, Change
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def test_diff():
+    golden = to_bytes(make_sii())
+    a = sii.from_bytes(golden, lazy=True)
+    b = sii.from_bytes(golden, lazy=True)
+    assert list(diff(a, b)) == []
+    # nothing was decoded to find that out
+    assert set(a._pending) == {'strings', 'general', 'fmmu', 'syncm'}
+
+    b.info.configured_alias.value = 0x4321
+    b.syncm[1].sync_manager_type.value = 'PROCESS_DATA_IN'
+    b.fmmu.append(sii.Fmmu())
+    b.general_name = 'EK1101'
+    b.unknown[0] = (0x0800, b'\x01\x02\x03\x05')
+    assert list(diff(a, b)) == [
+        Change('info', 'configured_alias', 0x1234, 0x4321),
+        Change('strings', '0', 'EK1100', 'EK1101'),
+        Change('fmmu', '2', None, 'UNUSED'),
+        Change('syncm', '1.sync_manager_type', 'MBX_IN', 'PROCESS_DATA_IN'),
+        Change('0x0800', 'raw.0', '01020304', '01020305'),
+    ]
+
+
+def test_diff_many(tmp_path):
+    golden = to_bytes(make_sii())
+    s = make_sii()
+    s.info.id.serial_number.value = 43
+    paths = []
+    for i, data in enumerate((golden, to_bytes(s), b'\x00')):
+        paths.append(str(tmp_path / '{}.bin'.format(i)))
+        with open(paths[-1], 'wb') as f:
+            f.write(data)
+    for workers in (1, 2):
+        same, serial, bad = diff_many(golden, paths, workers)
+        assert same == (paths[0], [], None)
+        assert serial == (paths[1], [Change('info', 'id.serial_number', 42, 43)], None)
+        assert bad[2].startswith('OutOfBytesError')
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from ecatprom import eeprom, sii
+from ecatprom.sii import CatType
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def test_read_sii():
+    data = to_bytes(make_sii())
+    dev = eeprom.SimulatedEeprom(data, latency=0)
+    s = asyncio.run(eeprom.read_sii(dev))
+    assert sii.to_bytes(s) == data
+
+    dev = eeprom.SimulatedEeprom(data, latency=0)
+    s = asyncio.run(eeprom.read_sii(dev, categories={CatType.STRINGS, CatType.General}))
+    assert s.general_name == 'EK1100'
+    assert s.syncm == None and s.unknown == []
+    assert dev.words_read < len(data) // 2
+
+
+def test_read_many():
+    devices = [eeprom.SimulatedEeprom(to_bytes(make_sii()), latency=0.05) for _ in range(50)]
+    start = time.perf_counter()
+    infos = asyncio.run(eeprom.read_many(eeprom.read_info, devices))
+    assert time.perf_counter() - start < 1
+    assert [i.id.serial_number.value for i in infos] == [42] * 50
+    bad = eeprom.SimulatedEeprom(b'\x00' * 10, latency=0)
+    assert isinstance(asyncio.run(eeprom.read_many(eeprom.read_sii, [bad]))[0],
+                      eeprom.OutOfBytesError)
+
+
+def test_write_sii(tmp_path):
+    data = to_bytes(make_sii())
+    path = tmp_path / 'a.bin'
+    path.write_bytes(bytes(len(data)))
+    f = eeprom.FileEeprom(str(path))
+    s = sii.from_bytes(data)
+    assert asyncio.run(eeprom.write_sii(f, s, max_words=16)) == None
+    assert path.read_bytes() == data
+
+    s.info.configured_alias.value = 0x4321
+    dev = eeprom.SimulatedEeprom(data, latency=0)
+    patch = asyncio.run(eeprom.write_sii(dev, s, original=data, fix_checksum=True))
+    assert len(patch) == 2 and dev.words_written == 2
+    assert asyncio.run(eeprom.read_sii(f)).info.configured_alias.value == 0x1234
+    assert sii.from_bytes(bytes(dev.data)).checksum_ok()
+
+    # a filtered read only ever writes back what it read
+    for original in (data, None):
+        dev = eeprom.SimulatedEeprom(data, latency=0)
+        s = asyncio.run(eeprom.read_sii(dev, categories={CatType.General}))
+        s.info.configured_alias.value = 7
+        asyncio.run(eeprom.write_sii(dev, s, original=original))
+        t = sii.from_bytes(bytes(dev.data))
+        assert t.info.configured_alias.value == 7
+        assert t.general_name == 'EK1100' and len(t.syncm) == 2
+        assert dev.words_written < len(data) // 2
@@ -0,0 +1,34 @@
+from io import StringIO
+import json
+
+from ecatprom import export
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def test_records():
+    s = make_sii()
+    (rec,) = export.iter_records(s, 'a.bin')
+    assert rec['file'] == 'a.bin'
+    assert rec['info.id.serial_number'] == 42
+    assert rec['syncm.1.sync_manager_type'] == 'MBX_IN'
+    assert rec['strings.0'] == 'EK1100'
+    assert rec['0x0800.raw'] == '01020304'
+    assert not any('reserved1' in k for k in rec)
+    cats = [r['category'] for r in export.iter_records(s, per='category')]
+    assert cats == ['info', 'strings', 'general', 'fmmu', 'syncm', '0x0800']
+
+
+def test_writers(tmp_path):
+    fname = str(tmp_path / 'a.bin')
+    with open(fname, 'wb') as f:
+        f.write(to_bytes(make_sii()))
+    out = StringIO()
+    export.write_ndjson([fname, fname + '.missing'], out)
+    good, bad = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert good['general.name_idx'] == 1
+    assert bad['error'].startswith('FileNotFoundError')
+    out = StringIO()
+    export.write_csv([fname], out)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'file,category,field,value'
+    assert '{},info,configured_alias,4660'.format(fname) in lines
@@ -0,0 +1,43 @@
+import os
+
+from ecatprom.fleet import FleetIndex
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def test_fleet_index(tmp_path):
+    a, b, bad = (str(tmp_path / n) for n in ('a.bin', 'b.bin', 'bad.bin'))
+    with open(a, 'wb') as f:
+        f.write(to_bytes(make_sii()))
+    s = make_sii()
+    s.info.id.revision_number.value = 0x00100000
+    s.syncm[0].physical_start_addr.value = 0x1800
+    with open(b, 'wb') as f:
+        f.write(to_bytes(s))
+    with open(bad, 'wb') as f:
+        f.write(b'\x00' * 10)
+
+    with FleetIndex(str(tmp_path / 'fleet.db')) as db:
+        assert db.update([a, b, bad], workers=1) == (3, 0, 0)
+        assert db.find(vendor_id=2) == [a, b]
+        assert db.find(name='EK1100', general_flags_enable_safe_op=0) == [a, b]
+        assert db.find(syncm_sync_manager_type='MBX_OUT',
+                       syncm_physical_start_addr=0x1000) == [a]
+        # both conditions have to hold for the same sync manager
+        assert db.find(syncm_sync_manager_type='MBX_IN',
+                       syncm_physical_start_addr=0x1000) == []
+        assert db.find('revision_number < ?', (0x00110000,)) == [b]
+        assert db.find('error IS NOT NULL') == [bad]
+        assert db.execute('SELECT value FROM strings WHERE path=? ORDER BY n',
+                          (a,)).fetchall() == [('EK1100',), ('Coupler',)]
+
+        assert db.update([a, b, bad], workers=1) == (0, 3, 0)
+        s.info.id.vendor_id.value = 3
+        with open(b, 'wb') as f:
+            f.write(to_bytes(s))
+        st = os.stat(b)
+        os.utime(b, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        os.remove(bad)
+        assert db.update([a, b], workers=1, prune=True) == (1, 1, 1)
+        assert db.find(vendor_id=2) == [a]
+        assert db.find(syncm_physical_start_addr=0x1800) == [b]
+        assert db.execute('SELECT count(*) FROM syncm').fetchone() == (4,)
@@ -0,0 +1,48 @@
+import os
+
+from ecatprom import batch
+from ecatprom.parsecache import ParseCache
+from ecatprom.test_sii import make_sii, to_bytes
+
+
+def test_parse_cache(tmp_path, monkeypatch):
+    a = tmp_path / 'a.bin'
+    bad = tmp_path / 'bad.bin'
+    a.write_bytes(to_bytes(make_sii()))
+    bad.write_bytes(b'\x00' * 10)
+    paths = [str(a), str(bad), str(tmp_path / 'missing.bin')]
+    db = str(tmp_path / 'cache' / 'parse.sqlite')
+
+    with ParseCache(db) as cache:
+        first = list(batch.parse_many(paths, workers=1, cache=cache))
+        assert first[0].name == 'EK1100'
+        assert first[1].error.startswith('OutOfBytesError')
+        assert first[2].error.startswith('FileNotFoundError')
+        assert cache.index(str(a)).find(10) != None
+
+    scanned = []
+    scan = batch.parsecache.scan
+    monkeypatch.setattr(batch.parsecache, 'scan', lambda p: scanned.append(p) or scan(p))
+    with ParseCache(db) as cache:
+        assert list(batch.parse_many(paths, workers=1, cache=cache)) == first
+        # unreadable files are tried again, the rest come from the cache
+        assert scanned == [paths[2]]
+
+        # touched but unchanged files are still hits
+        st = os.stat(a)
+        os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert cache.summary(str(a)) == first[0]
+
+        s = make_sii()
+        s.info.id.serial_number.value = 43
+        a.write_bytes(to_bytes(s))
+        assert cache.summary(str(a)) == None
+
+        assert 'EK1100' in cache.report(str(a))
+        assert cache.report(str(a)) == cache.report(str(a))
+        assert cache.summary(str(a)).serial_number == 43
+
+    # results of a different parser are thrown away
+    monkeypatch.setattr(batch.parsecache, 'parser_version', lambda: 'upgraded')
+    with ParseCache(db) as cache:
+        assert cache.summary(str(a)) == None
@@ -0,0 +1,316 @@
+from io import BytesIO
+import pytest
+from ecatprom import sii
+from ecatprom.sii import *
+
+
+def make_sii():
+    s = Sii()
+    s.info = InfoStructure()
+    s.info.configured_alias.value = 0x1234
+    s.info.id.vendor_id.value = 0x2
+    s.info.id.product_code.value = 0x044c2c52
+    s.info.id.revision_number.value = 0x00110000
+    s.info.id.serial_number.value = 42
+    s.info.size.value = 0x7F
+    s.info.version.value = 1
+    s.general = CategoryGeneral()
+    s.general_name = 'EK1100'
+    s.general_group = 'Coupler'
+    s.fmmu = Array(item_type=Fmmu)
+    for v in ('OUTPUTS', 'INPUTS'):
+        f = Fmmu()
+        f.value = v
+        s.fmmu.append(f)
+    s.syncm = Array(item_type=SyncM)
+    for start, typ in ((0x1000, 'MBX_OUT'), (0x1080, 'MBX_IN')):
+        m = SyncM()
+        m.physical_start_addr.value = start
+        m.length.value = 0x80
+        m.enable_sync_mananger.enable.value = 1
+        m.sync_manager_type.value = typ
+        s.syncm.append(m)
+    s.unknown.append((0x0800, b'\x01\x02\x03\x04'))
+    return s
+
+
+def to_bytes(s):
+    buffer = BytesIO()
+    w = Writer(buffer)
+    s.put(w)
+    w.flush()
+    return buffer.getvalue()
+
+
+def test_roundtrip():
+    data = to_bytes(make_sii())
+    s = from_bytes(data)
+    assert s.info.configured_alias.value == 0x1234
+    assert s.general_name == 'EK1100'
+    assert s.general_group == 'Coupler'
+    assert s.syncm[1].sync_manager_type.value == 'MBX_IN'
+    assert s.unknown == [(0x0800, b'\x01\x02\x03\x04')]
+    assert to_bytes(s) == data
+
+
+def test_from_file(tmp_path):
+    data = to_bytes(make_sii())
+    fname = tmp_path / 'prom.bin'
+    fname.write_bytes(data)
+    s = sii.from_file(str(fname))
+    assert s.info.id.serial_number.value == 42
+    assert to_bytes(s) == data
+
+
+def test_lazy():
+    data = to_bytes(make_sii())
+    s = from_bytes(data, lazy=True)
+    assert s._cats['syncm'] == None
+    assert to_bytes(s) == data
+    assert s.general_name == 'EK1100'
+    assert s.syncm[0].physical_start_addr.value == 0x1000
+    assert not s._pending.keys() & {'general', 'syncm', 'strings'}
+    assert to_bytes(s) == data
+    assert str(s) == str(from_bytes(data))
+
+
+def test_lazy_malformed():
+    data = bytearray(to_bytes(make_sii()))
+    e = SiiIndex.build(data).find(CatType.General)
+    data[2*e.word_offset - 2] += 1
+    data[2*(e.word_offset + e.word_length):2*(e.word_offset + e.word_length)] = b'\xaa\xbb'
+    data = bytes(data)
+    s = from_bytes(data, lazy=True)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            s.general
+    assert s.syncm[0].physical_start_addr.value == 0x1000
+    assert to_bytes(s) == data
+
+
+def test_kept_payloads(tmp_path):
+    data = to_bytes(make_sii())
+    # views of immutable bytes, copies of anything else
+    for lazy in (False, True):
+        assert from_bytes(data, lazy).raw_payloads('syncm')[0].obj is data
+        raw = from_bytes(bytearray(data), lazy).raw_payloads('syncm')[0]
+        assert type(raw) == bytes
+    fname = tmp_path / 'prom.bin'
+    fname.write_bytes(data)
+    s = sii.from_file(str(fname))
+    assert type(s.raw_payloads('syncm')[0]) == bytes
+    assert to_bytes(s) == data
+
+
+def test_index():
+    data = to_bytes(make_sii())
+    idx = SiiIndex.build(data)
+    assert [e.category_type for e in idx.entries] == [
+        CatType.STRINGS, CatType.General, CatType.FMMU, CatType.SyncM, 0x0800]
+    syncm = idx.take(data, CatType.SyncM)
+    assert syncm[1].physical_start_addr.value == 0x1080
+    assert idx.take(data, 0x0800) == b'\x01\x02\x03\x04'
+    assert idx.take(data, CatType.DC) == None
+    e = idx.find(CatType.General)
+    assert data[2*e.word_offset - 4:2*e.word_offset] == b'\x1e\x00\x10\x00'
+    assert SiiIndex.loads(idx.dumps()) == idx
+
+
+def test_from_stream(tmp_path):
+    data = to_bytes(make_sii())
+    f = BytesIO(b'\xff' * 6 + data + data)
+    f.seek(6)
+    idx, n = SiiIndex.scan(f, 6)
+    assert idx == SiiIndex.build(data) and n == 4 * 6
+    f.seek(6)
+    s, n = from_stream(f, {CatType.STRINGS, CatType.General})
+    assert s.general_name == 'EK1100' and s.syncm == None and s.unknown == []
+    assert n == 128 + 4 * 6 + len(s.raw_payloads('strings')[0]) + \
+        len(s.raw_payloads('general')[0])
+    assert to_bytes(from_stream(f)[0]) == data
+
+    path = tmp_path / 'a.bin'
+    path.write_bytes(data)
+    s = from_file(str(path), categories=[CatType.STRINGS, 0x0800])
+    assert s.general_name == None
+    assert s.unknown == [(0x0800, b'\x01\x02\x03\x04')]
+    path.write_bytes(data[:-2])
+    with pytest.raises(OutOfBytesError):
+        from_file(str(path), categories=[])
+
+
+def test_partial_patch(tmp_path):
+    data = to_bytes(make_sii())
+    path = tmp_path / 'a.bin'
+    path.write_bytes(data)
+    s = from_file(str(path), categories=[CatType.General])
+    assert [e.category_type for e in s.skipped] == [
+        CatType.STRINGS, CatType.FMMU, CatType.SyncM, 0x0800]
+    with pytest.raises(RuntimeError):
+        to_bytes(s)
+    with pytest.raises(RuntimeError):
+        sii.to_file(s, str(path))
+    assert path.read_bytes() == data
+    s.info.configured_alias.value = 7
+    s.general.current_on_ebus.value = 100
+    patch = patch_file(s, str(path))
+    assert len(patch) == 2
+    t = from_file(str(path))
+    assert t.info.configured_alias.value == 7
+    assert t.general.current_on_ebus.value == 100
+    assert t.general_name == 'EK1100' and len(t.syncm) == 2
+    assert t.unknown == [(0x0800, b'\x01\x02\x03\x04')]
+    # nothing to put a new string in, strings wasnt read
+    s.general_name = 'EK1101'
+    with pytest.raises(ValueError):
+        patch_file(s, str(path))
+    assert path.read_bytes() == to_bytes(t)
+
+
+def test_checksum():
+    s = make_sii()
+    assert not s.checksum_ok()
+    data = to_bytes(s)
+    buffer = BytesIO()
+    s.put(Writer(buffer), fix_checksum=True)
+    assert s.checksum_ok()
+    fixed = buffer.getvalue()
+    assert fixed[14] == crc.config_crc(data) and fixed[15] == 0
+    assert fixed[:14] + fixed[16:] == data[:14] + data[16:]
+
+
+def test_put_only_reencodes_changes():
+    data = to_bytes(make_sii())
+    s = from_bytes(data)
+    assert not s.info.dirty and not s.syncm.dirty
+    # garble the kept raw bytes so we can see which ones get copied out
+    s._orig['syncm'] = (s.syncm, [b'\xAA' * 16])
+    s._orig['info'] = (s.info, b'\xBB' * 128)
+    out = to_bytes(s)
+    assert out[:128] == b'\xBB' * 128
+    assert b'\xAA' * 16 in out
+    s.info.configured_alias.value = 7
+    s.syncm[0].length.value = 0x40
+    assert s.info.dirty and s.syncm.dirty
+    s.info.configured_alias.value = 0x1234
+    s.syncm[0].length.value = 0x80
+    # re-encoded info keeps the reserved bytes of what it was taken from
+    expected = bytearray(data)
+    for offset, n in codec_for(InfoStructure).gaps:
+        expected[offset:offset + n] = b'\xBB' * n
+    assert to_bytes(s) == expected
+
+
+def test_checksum_keeps_reserved():
+    data = bytearray(to_bytes(make_sii()))
+    data[10:14] = b'\x01\x02\x03\x04'  # reserved1, inside the config area
+    data[14] = crc.config_crc(data)
+    s = from_bytes(bytes(data))
+    assert s.checksum_ok() and not list(crc.check_images([data]))
+    s.info.configured_alias.value = 7
+    assert not s.checksum_ok()
+    out = sii.to_bytes(s, fix_checksum=True)
+    assert out[10:14] == b'\x01\x02\x03\x04'
+    assert out[14] == crc.config_crc(out)
+
+
+def test_patch_file(tmp_path):
+    data = to_bytes(make_sii())
+    fname = str(tmp_path / 'prom.bin')
+    with open(fname, 'wb') as f:
+        f.write(data)
+    s = sii.from_file(fname)
+    s.info.configured_alias.value = 0x0007
+    s.info.id.serial_number.value = 0x00010002
+    patch = sii.patch_file(s, fname)
+    assert patch == [(4, 0x0007), (0xE, 0x0002), (0xF, 0x0001)]
+    assert sii.patch_runs(patch) == [(4, b'\x07\x00'), (0xE, b'\x02\x00\x01\x00')]
+    with open(fname, 'rb') as f:
+        assert f.read() == sii.to_bytes(s)
+    assert sii.patch_file(s, fname) == []
+
+
+def test_shared_options():
+    assert DescriptionOfPort().options is DescriptionOfPort().options
+    assert SyncM().sync_manager_type.options is SYNCM_TYPES
+
+
+def test_pdos():
+    from ecatprom.bench import synthetic_image
+    data = synthetic_image(pdos=3, pdo_entries=4)
+    s = from_bytes(data)
+    assert len(s.txpdo) == len(s.rxpdo) == 3
+    assert s.txpdo[1].header.index.value == 0x1A01
+    assert [e.subindex.value for e in s.rxpdo[2].entries] == [1, 2, 3, 4]
+    assert to_bytes(s) == data
+    table = pdo_table(s.txpdo)
+    assert len(table.bit_len) == 12
+    assert list(table.pdo[:5]) == [0x1A00] * 4 + [0x1A01]
+    bits = s.process_data_bits()
+    assert bits[1] == sum(table.bit_len)
+    assert from_bytes(data, lazy=True).process_data_bits() == bits
+    assert SiiIndex.build(data).process_data_bits(data) == bits
+    # edits get written out as a single category
+    s.txpdo[0].entries.append(PdoEntry())
+    s.txpdo[0].entries[-1].bit_len.value = 16
+    again = from_bytes(to_bytes(s))
+    assert again.txpdo[0].header.n_entries.value == 5
+    assert again.process_data_bits() == (bits[0], bits[1] + 16)
+    assert pdo_table(again.rxpdo) == pdo_table(s.rxpdo)
+
+
+def test_dc_and_sync_units():
+    s = make_sii()
+    s.dc = Array(item_type=CategoryDc)
+    for cycle in (1000000, 500000):
+        d = CategoryDc()
+        d.cycle_time_0.value = cycle
+        d.assign_activate.value = 0x300
+        s.dc.append(d)
+    s.sync_unit = Array(item_type=SyncUnit)
+    for flag in (1, 0):
+        u = SyncUnit()
+        u.separate_frame.value = flag
+        s.sync_unit.append(u)
+    data = to_bytes(s)
+    again = from_bytes(data)
+    assert len(again.dc) == 2
+    assert again.dc[1].cycle_time_0.value == 500000
+    assert list(again.dc.column('cycle_time_0')) == [1000000, 500000]
+    assert list(again.sync_unit.column('separate_frame')) == [1, 0]
+    idx = SiiIndex.build(data)
+    cols = idx.columns(data, CatType.DC)
+    assert list(cols['cycle_time_0']) == [1000000, 500000]
+    assert list(cols['assign_activate']) == [0x300] * 2
+    assert list(idx.columns(data, CatType.SyncM)['enable_sync_mananger.enable']) == [1, 1]
+    cols = columns_many([data, to_bytes(make_sii()), data], CatType.DC, ['cycle_time_0'])
+    assert list(cols['cycle_time_0']) == [1000000, 500000] * 2
+    assert list(cols['image']) == [0, 0, 2, 2]
+
+
+def test_strings():
+    s = make_sii()
+    s.dc = Array(item_type=CategoryDc)
+    s.dc.append(CategoryDc())
+    s.dc[0].name_idx.value = s.intern_string('DC sync')
+    s.dc[0].desc_idx.value = s.intern_string('EK1100')
+    assert [x.value for x in s.strings] == ['EK1100', 'Coupler', 'DC sync']
+    assert s.string_refcounts() == [3, 2, 1, 1]
+    # the DC name survives compacting now
+    s.general_name = 'EK1101'
+    assert [x.value for x in s.strings] == ['EK1100', 'Coupler', 'DC sync', 'EK1101']
+    s.dc[0].desc_idx.value = 0
+    s.general_group = 'EK1101'
+    assert s.general_name == s.general_group == 'EK1101'
+    assert [x.value for x in s.strings] == ['EK1101', 'DC sync']
+    assert s.dc[0].name_idx.value == 2
+    again = from_bytes(to_bytes(s))
+    assert again.general_name == 'EK1101'
+    assert again.strings[again.dc[0].name_idx.value - 1].value == 'DC sync'
+    # the second group index is remapped too
+    s.general_group = 'Other'
+    s.general.group_idx_1.value = s.general.group_idx.value
+    s.dc[0].name_idx.value = 0
+    s.compact_strings()
+    assert [x.value for x in s.strings] == ['EK1101', 'Other']
+    assert s.general.group_idx.value == s.general.group_idx_1.value == 2
@@ -0,0 +1,27 @@
+from io import BytesIO
+
+from ecatprom import sii
+from ecatprom.template import Template
+from ecatprom.test_sii import make_sii
+
+
+def test_template():
+    golden = sii.to_bytes(make_sii(), fix_checksum=True)
+    t = Template(golden)
+    assert t.golden_values() == (42, 0x1234)
+
+    def expected(serial, alias):
+        s = sii.from_bytes(golden)
+        s.info.id.serial_number.value = serial
+        s.info.configured_alias.value = alias
+        return sii.to_bytes(s, fix_checksum=True)
+
+    assert t.render((7, 0x4321)) == expected(7, 0x4321)
+    assert t.render(t.golden_values()) == golden
+
+    rows = [(1000 + i, i * 3) for i in range(10)]
+    out = BytesIO()
+    assert t.write_many(rows, out, batch=3) == 10
+    data = out.getvalue()
+    assert data == b''.join(expected(*r) for r in rows)
+    assert sii.from_bytes(data[len(t) * 9:]).checksum_ok()
@@ -12,7 +12,7 @@ DESCRIPTION = 'Library and Tk GUI for manipulating EtherCAT SII Prom files'
 URL = 'https://github.com/sdonnan/ecatprom'
 EMAIL = 'sdonnan@fastmail.com'
 AUTHOR = 'S Donnan'
-REQUIRES_PYTHON = '>=3.6.0'
+REQUIRES_PYTHON = '>=3.7.0'
 VERSION = '0.1.0'
 
 # What packages are required for this module to be executed?
@@ -56,7 +56,7 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: Implementation :: CPython',
         'Programming Language :: Python :: Implementation :: PyPy'
     ],